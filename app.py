@@ -1,58 +1,192 @@
+import importlib.util
+import json
 import os
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 import dotenv
 import pandas as pd
 import streamlit as st
-from openai import OpenAI
 
-from modules.article_generator import ArticleGenerator
-from modules.audio_downloader import download_and_chunk_audio
-from modules.audio_metadata_retriever import PodcastMetaDataRetriever
-from modules.transcriber import transcribe
-from modules.translator import translate
+from modules.artifact_store import ArtifactStore
+from modules.episode_index import EpisodeIndex, format_pub_date
+from modules.feed_store import FeedStore
+from modules.job_manager import Job, JobManager
+from modules.tracer import TRACER, JsonLinesExporter, OtlpExporter, get_breakdown
+
+if TYPE_CHECKING:
+    from modules.pipeline import PipelineResult
+    from modules.request_scheduler import ScheduledClient
+    from modules.transcriber import TranscriptionBackend
+
+# Streamlit runs this script again on every interaction, so objects that
+# outlive a run are cached with st.cache_resource, and modules that only
+# a stage needs (openai, ffmpeg, the pipeline) are imported by that stage.
 
 dotenv.load_dotenv()
 
 # constants
 OUTPUT_DIR = Path("./output")
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-if OPENAI_API_KEY is None:
-    OPENAI_API_KEY = st.secrets["OPENAI_API_KEY"]
-CLIENT = OpenAI(api_key=OPENAI_API_KEY)
 TRANSCRIBE_MODEL_NAME = "whisper-1"
+LOCAL_MODEL_SIZE = "small"
+# the local backend is only offered when its optional package is installed
+LIST_TRANSCRIPTION_BACKEND = ["openai"] + (
+    ["local"] if importlib.util.find_spec("faster_whisper") is not None else []
+)
 MODEL_NAME = "gpt-4o-mini"
 CHUNK_SIZE = 4096
+MAX_WORKERS = 8
+EPISODE_PAGE_SIZE = 20
+TARGET_CHUNK_BYTES = 5 * 1024 * 1024
+TRACE_FILE_PATH = OUTPUT_DIR / "traces.jsonl"
+# seconds between two refreshes of the progress of a running job
+JOB_POLL_SECONDS = 0.5
+# characters of a page of the transcript, and segments of a page of summaries
+TRANSCRIPT_PAGE_CHARS = 5000
+SEGMENT_PAGE_SIZE = 5
+DICT_PROGRESS_TEXT = {
+    "chunk": "Downloading and chunking audio...",
+    "transcribe": "Transcribing audio...",
+    "summarize": "Writing summary of segment of the episode...",
+    "summarize_summaries": "Summarizing summaries...",
+}
+
+
+@st.cache_resource
+def init_tracer() -> None:
+    """Export traces to TRACE_FILE_PATH, and to an OTLP/HTTP endpoint if
+    OTEL_EXPORTER_OTLP_ENDPOINT is set. Runs once per server process.
+    """
+    TRACER.add_exporter(JsonLinesExporter(TRACE_FILE_PATH))
+    otlp_endpoint = os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT")
+    if otlp_endpoint is not None:
+        TRACER.add_exporter(OtlpExporter(endpoint=otlp_endpoint))
+
+
+@st.cache_resource
+def get_client() -> "ScheduledClient":
+    """Returns the OpenAI client shared by every session, so that its
+    connection pool and the rate limits of the account are shared too
+    """
+    from openai import OpenAI
+
+    from modules.request_scheduler import ScheduledClient
+
+    openai_api_key = os.environ.get("OPENAI_API_KEY")
+    if openai_api_key is None:
+        openai_api_key = st.secrets["OPENAI_API_KEY"]
+    return ScheduledClient(OpenAI(api_key=openai_api_key))
+
+
+@st.cache_resource
+def get_store() -> ArtifactStore:
+    """Returns the artifact store shared by every session"""
+    return ArtifactStore(OUTPUT_DIR / "store", max_bytes=10 * 1024**3)
+
+
+@st.cache_resource
+def get_feed_store() -> FeedStore:
+    """Returns the feed store shared by every session"""
+    return FeedStore(OUTPUT_DIR / "feeds")
+
+
+@st.cache_resource
+def get_job_manager() -> JobManager:
+    """Returns the manager of the pipeline jobs of every session"""
+    return JobManager(OUTPUT_DIR / "locks")
+
+
+@st.cache_resource
+def get_transcription_backend(name: str) -> "TranscriptionBackend":
+    """Returns the transcription backend, shared by every session so that
+    the local model is loaded once per server process
+    """
+    from modules.transcriber import get_backend
+
+    if name == "local":
+        return get_backend(name, model_name=LOCAL_MODEL_SIZE)
+    return get_backend(name, client=get_client(), model_name=TRANSCRIBE_MODEL_NAME)
+
+
+@st.cache_resource(ttl=10 * 60)
+def get_episode_index(url: str) -> EpisodeIndex:
+    """Get the searchable index of the podcast episodes, once per feed"""
+    return get_feed_store().get_index(url)
+
 
+def get_result_key(job_key: str, *parts: str) -> str:
+    """Returns the store key of a part of the generated contents of a job"""
+    return ArtifactStore.make_key("episode_result", job_key, *parts)
 
-@st.cache_data
-def get_metadata(url: str) -> pd.DataFrame:
-    """Get metadata of podcast episodes"""
-    podcast_metadata_retriever = PodcastMetaDataRetriever(url)
-    podcast_metadata_collection = podcast_metadata_retriever.get_data()
-    df = podcast_metadata_collection.to_dataframe()
-    df = df.sort_values(by="pubDate", ascending=False).reset_index(drop=True)
-    df["pubDate_str"] = df["pubDate"].apply(
-        lambda ts: ts.strftime("%Y/%m/%d") if pd.notnull(ts) else ts
+
+def put_result(job_key: str, pipeline_result: "PipelineResult") -> None:
+    """Store the generated contents, so that sessions only keep the job key"""
+    store = get_store()
+    store.put_text(get_result_key(job_key, "transcript"), pipeline_result.transcript)
+    # the summary goes first, as the generated contents are shown once it exists
+    store.put_text(
+        get_result_key(job_key, "texts"),
+        json.dumps([pipeline_result.summary] + pipeline_result.list_summary_detail),
     )
-    return df
 
 
-# Initialize session state
+def has_result(job_key: str) -> bool:
+    """Returns whether all the generated contents of the job are in the store"""
+    store = get_store()
+    return all(
+        store.get_path(get_result_key(job_key, part)) is not None
+        for part in ["texts", "transcript"]
+    )
+
+
+def get_stored_text(key: str) -> str:
+    """Returns a stored part of the generated contents"""
+    text = get_store().get_text(key)
+    if text is None:
+        raise Exception("Generated contents were evicted, please generate again")
+    return text
+
+
+@st.cache_resource(max_entries=32)
+def get_transcript_pages(key: str) -> tuple[str, ...]:
+    """Returns the pages of a stored transcript"""
+    from modules.text_splitter import split_pages
+
+    return tuple(split_pages(get_stored_text(key), TRANSCRIPT_PAGE_CHARS))
+
+
+@st.cache_resource(max_entries=32)
+def get_texts(key: str) -> tuple[str, ...]:
+    """Returns the summary and the segment summaries, or their translations"""
+    return tuple(json.loads(get_stored_text(key)))
+
+
+def show_page(n_item: int, page_size: int, key: str) -> range:
+    """Show a page number input and return the items of the selected page"""
+    n_page = max(1, -(-n_item // page_size))
+    cols_page = st.columns([1, 3])
+    page = min(cols_page[0].number_input("Page", min_value=1, key=key), n_page) - 1
+    cols_page[1].caption(f"Page {page + 1} of {n_page}")
+    return range(page * page_size, min(n_item, (page + 1) * page_size))
+
+
+def show_segments(list_text: tuple[str, ...], key: str) -> None:
+    """Show one page of segment summaries, the first text being the summary"""
+    for idx in show_page(len(list_text) - 1, SEGMENT_PAGE_SIZE, key):
+        st.subheader(f"Segment {idx + 1}")
+        st.markdown(list_text[idx + 1])
+
+
+init_tracer()
+
+# Initialize session state. Generated contents stay in the store, and the
+# session keeps the key of the job that made them.
 if "current_episode_id" not in st.session_state:
     st.session_state["current_episode_id"] = None
-if "generated" not in st.session_state:
-    st.session_state["generated"] = False
-if "transcript" not in st.session_state:
-    st.session_state["transcript"] = None
-if "summary" not in st.session_state:
-    st.session_state["summary"] = None
-if "list_summary_detail" not in st.session_state:
-    st.session_state["list_summary_detail"] = None
-if "summary_translated" not in st.session_state:
-    st.session_state["summary_translated"] = None
-if "list_summary_detail_translated" not in st.session_state:
-    st.session_state["list_summary_detail_translated"] = None
+if "result_key" not in st.session_state:
+    st.session_state["result_key"] = None
+if "translation_language" not in st.session_state:
+    st.session_state["translation_language"] = None
 
 # Title and rss feed url
 st.title("Podcast summary generator")
@@ -69,165 +203,231 @@ st.link_button(
 url = st.text_input(
     "Enter a podcast RSS feed URL",
     value="https://podcasts.files.bbci.co.uk/p02nrsjn.rss",
+    key="url",
 )
 
 # Get metadata of podcast episodes
-df = get_metadata(url)
-list_episode_label = [
-    f"No. {episode['id']}: {episode['title']} - {episode['pubDate_str']}"
-    for episode in df.to_dict("records")
-]
-
-# Select episode
-episode = st.selectbox("Select an episode from the podcast channel", list_episode_label)
+episode_index = get_episode_index(url)
+if len(episode_index) == 0:
+    st.warning("The feed has no episodes.")
+    st.stop()
+
+# Search and select episode, one page of matches at a time
+query = st.text_input(
+    "Search episodes by title or description",
+    key="query",
+    on_change=lambda: st.session_state.update(page=1),
+)
+episode_page = episode_index.search(
+    query, page=st.session_state.get("page", 1) - 1, page_size=EPISODE_PAGE_SIZE
+)
+# the selected episode stays selected while other pages are shown
+selected_idx = episode_index.get_row(st.session_state["current_episode_id"])
+if selected_idx is None:
+    selected_idx = 0
+idx = st.selectbox(
+    "Select an episode from the podcast channel",
+    episode_page.list_idx,
+    index=(
+        episode_page.list_idx.index(selected_idx)
+        if selected_idx in episode_page.list_idx
+        else None
+    ),
+    format_func=episode_index.get_label,
+    placeholder=episode_index.get_label(selected_idx),
+)
+if idx is None:
+    idx = selected_idx
+cols_page = st.columns([1, 3])
+cols_page[0].number_input("Page", min_value=1, key="page")
+cols_page[1].caption(
+    f"{episode_page.n_match} of {len(episode_index)} episodes, "
+    f"page {episode_page.page + 1} of {episode_page.n_page}"
+)
 st.markdown("<br>", unsafe_allow_html=True)
-idx = list_episode_label.index(episode)
-df_episode = df.iloc[idx]
+podcast_metadata = episode_index.get_episode(idx)
 
 # Initialize session state if episode is changed
-if st.session_state["current_episode_id"] != df_episode["id"]:
-    st.session_state["current_episode_id"] = df_episode["id"]
-    st.session_state["generated"] = False
-    st.session_state["transcript"] = None
-    st.session_state["summary"] = None
-    st.session_state["list_summary_detail"] = None
-    st.session_state["summary_translated"] = None
-    st.session_state["list_summary_detail_translated"] = None
+if st.session_state["current_episode_id"] != podcast_metadata.id:
+    st.session_state["current_episode_id"] = podcast_metadata.id
+    st.session_state["result_key"] = None
+    st.session_state["translation_language"] = None
+    for key in ["page_segment", "page_transcript", "page_translated"]:
+        st.session_state.pop(key, None)
 
 # Show information of the episode
 st.markdown(
     f"""
-#### Selected episode: {df_episode["title"]}
+#### Selected episode: {podcast_metadata.title}
 """
 )
 with st.expander("Show information of the episode"):
     st.markdown(
         f"""
-    - Creator: {df_episode["creator"]}
-    - Publication date: {df_episode["pubDate_str"]}
-    - Duration: {df_episode["duration"]}
-    - URL: [Link]({df_episode["enclosure"]})
+    - Creator: {podcast_metadata.creator}
+    - Publication date: {format_pub_date(podcast_metadata.pubDate)}
+    - Duration: {podcast_metadata.duration}
+    - URL: [Link]({podcast_metadata.enclosure})
     - Description: 
     """
     )
-    st.markdown(df_episode["description"], unsafe_allow_html=True)
+    st.markdown(podcast_metadata.description, unsafe_allow_html=True)
 st.markdown("<br>", unsafe_allow_html=True)
 
 # Generate summary
+with st.sidebar:
+    transcription_backend_name = st.selectbox(
+        "Transcription",
+        LIST_TRANSCRIPTION_BACKEND,
+        format_func=lambda name: {
+            "openai": "OpenAI API",
+            "local": f"Local CPU (faster-whisper {LOCAL_MODEL_SIZE})",
+        }[name],
+    )
 cols = st.columns(3)
 is_generate = cols[1].button("Generate a summary!")
 st.markdown("<br>", unsafe_allow_html=True)
-if is_generate and not st.session_state["generated"]:
-    title = f"{df_episode['id']}_{df_episode['title']}"
-    chunk_dir = OUTPUT_DIR / f"{title}"
-    # Download and chunk audio
-    with st.spinner("Downloading and chunking audio..."):
-        if chunk_dir.exists():
-            chunk_dir = chunk_dir
-        else:
-            chunk_dir = download_and_chunk_audio(
-                url=df_episode["enclosure"],
-                title=f"{df_episode['id']}_{df_episode['title']}",
-                output_dir=OUTPUT_DIR,
-            )
-    st.info("Successfully downloaded audio")
-
-    # Transcribe audio
-    progress_text = "Transcribing audio... Please wait."
-    transcript_file_path = chunk_dir / "transcript.txt"
-    if transcript_file_path.exists():
-        with open(transcript_file_path, "r") as f:
-            st.session_state["transcript"] = f.read()
-    else:
-        progress_bar = st.progress(0, text=progress_text)
-        list_audio_path = sorted(
-            chunk_dir.iterdir(),
-            key=lambda path: str(path).lower(),
-        )
-        list_transcript = []
-        for idx, audio_path in enumerate(list_audio_path):
-            transcript = transcribe(
-                client=CLIENT,
-                audio_file_path=audio_path,
-                model_name=TRANSCRIBE_MODEL_NAME,
-            )
-            list_transcript.append(transcript)
-            progress_bar.progress((idx + 1) / len(list_audio_path), text=progress_text)
-        progress_bar.empty()
-        st.session_state["transcript"] = "".join(list_transcript)
-        with open(chunk_dir / "transcript.txt", "w") as f:
-            f.write(st.session_state["transcript"])
-    st.info("Successfully transcribed audio")
-    with st.expander("Show the transcription"):
-        st.write(st.session_state["transcript"])
-
-    # Summarize transcript
-    progress_text = "Writing summary of segment of the episode... Please wait."
-    progress_bar = st.progress(0, text=progress_text)
-    article_generator = ArticleGenerator(
-        title=df_episode["title"],
-        text=st.session_state["transcript"],
-        client=CLIENT,
+# sessions asking for the same episode with the same settings share one job
+job_key = ArtifactStore.make_key(
+    "episode",
+    podcast_metadata.enclosure,
+    transcription_backend_name,
+    (
+        TRANSCRIBE_MODEL_NAME
+        if transcription_backend_name == "openai"
+        else LOCAL_MODEL_SIZE
+    ),
+    MODEL_NAME,
+    CHUNK_SIZE,
+)
+job = get_job_manager().get(job_key)
+# a finished job whose contents have been evicted is stale, and Generate
+# starts a new one
+if job is not None and job.status == "done" and not has_result(job.key):
+    job = None
+# contents generated earlier, by any session, are shown without a new job
+if st.session_state["result_key"] is None and has_result(job_key):
+    st.session_state["result_key"] = job_key
+# contents that have been evicted from the store have to be generated again
+if st.session_state["result_key"] is not None and not has_result(
+    st.session_state["result_key"]
+):
+    st.session_state["result_key"] = None
+if is_generate and st.session_state["result_key"] is None:
+    from modules.audio_downloader import SPEECH_MP3
+    from modules.pipeline import EpisodePipeline
+
+    # Download, chunk, transcribe and summarize with overlapping stages,
+    # in a worker thread that outlives this script run
+    episode_pipeline = EpisodePipeline(
+        client=get_client(),
+        store=get_store(),
+        transcribe_model_name=TRANSCRIBE_MODEL_NAME,
         model_name=MODEL_NAME,
         chunk_size=CHUNK_SIZE,
+        profile=SPEECH_MP3,
+        target_chunk_bytes=TARGET_CHUNK_BYTES,
+        max_workers=MAX_WORKERS,
+        transcription_backend=get_transcription_backend(transcription_backend_name),
     )
-    list_summary_detail = []
-    for idx, text in enumerate(article_generator.list_split_text):
-        summary_detail = article_generator.summarize_transcript(
-            text=text, title=article_generator.title, max_tokens=CHUNK_SIZE * 2
-        )
-        list_summary_detail.append(f"{summary_detail} \n\n")
-        progress_bar.progress(
-            (idx + 1) / len(article_generator.list_split_text), text=progress_text
+    url_episode = podcast_metadata.enclosure
+    title_episode = podcast_metadata.title
+
+    def run_pipeline(job: Job) -> None:
+        # each job downloads into a directory of its own
+        pipeline_result = episode_pipeline.run(
+            url=url_episode,
+            title=title_episode,
+            work_dir=OUTPUT_DIR / "work" / job.key,
+            callback=job.on_event,
+            text_callback=job.on_text,
         )
-    progress_bar.empty()
-    st.session_state["list_summary_detail"] = list_summary_detail
-    st.info("Successfully summarized each segment of the episode")
-    with st.expander("Show summaries of each segment of the episode."):
-        for idx, summary_detail in enumerate(st.session_state["list_summary_detail"]):
+        put_result(job.key, pipeline_result)
+
+    job = get_job_manager().submit(job_key, run_pipeline)
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def show_job(job: Job) -> None:
+    """Show the progress and the summaries so far of the job of the episode,
+    polled by this fragment alone so that the rest of the page stays usable
+    """
+    if job.status == "done":
+        # contents evicted right after the job are not accepted, as the next
+        # run would drop the key and show this job again
+        if has_result(job.key):
+            st.session_state["result_key"] = job.key
+            st.rerun()
+        st.warning("Generated contents were evicted, please generate again.")
+        return
+    if job.status == "failed":
+        st.error(f"Failed to generate the summary: {job.error!r}")
+        return
+    if job.status == "queued":
+        st.info("Waiting for other episodes to finish...")
+    elif job.status == "waiting":
+        st.info("This episode is being processed by another worker...")
+
+    dict_event, dict_text = job.snapshot()
+    for stage, progress_text in DICT_PROGRESS_TEXT.items():
+        event = dict_event.get(stage)
+        if event is None:
+            st.progress(0, text=f"{progress_text} Please wait.")
+        elif event.n_total is None:
+            text = f"{progress_text} ({event.n_done} done) Please wait."
+            st.progress(0, text=text)
+        else:
+            text = f"{progress_text} ({event.n_done}/{event.n_total}) Please wait."
+            value = event.n_done / event.n_total if event.n_total > 0 else 1.0
+            st.progress(value, text=text)
+
+    # summaries are shown while they are generated
+    if ("summarize_summaries", 0) in dict_text:
+        st.markdown(dict_text[("summarize_summaries", 0)])
+    for (stage, idx), text in sorted(dict_text.items()):
+        if stage == "summarize":
             st.subheader(f"Segment {idx + 1}")
-            st.markdown(summary_detail)
+            st.markdown(text)
 
-    # Summarize summaries
-    with st.spinner("Summarizing summaries... Please wait."):
-        summary = article_generator.summarize_summaries(
-            texts=list_summary_detail, max_tokens=CHUNK_SIZE * 2
-        )
-        st.session_state["summary"] = summary
 
-    st.info("Successfully summarized summaries")
-    st.session_state["generated"] = True
-    st.rerun()
+if job is not None and st.session_state["result_key"] is None:
+    show_job(job)
 
-# Show summary
-if st.session_state["generated"]:
+# Show one part of the generated contents, one page at a time
+result_key = st.session_state["result_key"]
+if result_key is not None:
+    language = st.session_state["translation_language"]
     st.subheader("Generated contents")
-    with st.expander("Summary"):
-        st.markdown(st.session_state["summary"])
-    with st.expander("Detailed summary"):
-        for idx, summary_detail in enumerate(st.session_state["list_summary_detail"]):
-            st.subheader(f"Segment {idx + 1}")
-            st.markdown(summary_detail)
-    with st.expander("Transcript"):
-        st.markdown(st.session_state["transcript"])
+    list_view = ["Summary", "Detailed summary", "Transcript"]
+    if language is not None:
+        list_view += [f"Summary ({language})", f"Detailed summary ({language})"]
+    view = st.radio("Show", list_view, horizontal=True, label_visibility="collapsed")
+    is_translated = view not in ["Summary", "Detailed summary", "Transcript"]
+    try:
+        if view == "Transcript":
+            list_text = get_transcript_pages(get_result_key(result_key, "transcript"))
+        elif is_translated:
+            list_text = get_texts(get_result_key(result_key, "translation", language))
+        else:
+            list_text = get_texts(get_result_key(result_key, "texts"))
+    except Exception:
+        # evicted since it was checked, so it is generated or translated again
+        if is_translated:
+            st.session_state["translation_language"] = None
+        else:
+            st.session_state["result_key"] = None
+        st.rerun()
+    if view == "Transcript":
+        for idx in show_page(len(list_text), 1, "page_transcript"):
+            st.markdown(list_text[idx])
+    elif view in ["Summary", f"Summary ({language})"]:
+        st.markdown(list_text[0])
+    else:
+        show_segments(list_text, "page_translated" if is_translated else "page_segment")
     st.markdown("<br>", unsafe_allow_html=True)
-    if (
-        st.session_state["summary_translated"] is not None
-        and st.session_state["list_summary_detail_translated"] is not None
-    ):
-        st.subheader("Translated contents")
-        with st.expander("Show summary translated"):
-            st.markdown(st.session_state["summary_translated"])
-        with st.expander("Show detailed summary translated"):
-            for idx, summary_detail_translated in enumerate(
-                st.session_state["list_summary_detail_translated"]
-            ):
-                st.subheader(f"Segment {idx + 1}")
-                st.markdown(summary_detail_translated)
-        st.markdown("<br>", unsafe_allow_html=True)
 
 # Translate summary
-if st.session_state["generated"]:
+if result_key is not None:
     st.subheader("Translation")
     language_to_translate = st.text_input(
         "Enter language to translate. If translation is not needed, skip this.",
@@ -238,36 +438,59 @@ if st.session_state["generated"]:
     if language_to_translate is None and is_translate:
         st.warning("Please enter language to translate.")
     elif is_translate:
+        from modules.translator import translate_many
+
         progress_text = "Translating summary... Please wait."
         progress_bar = st.progress(0, text=progress_text)
-        translated_summary = translate(
-            text=st.session_state["summary"],
+        list_text = get_texts(get_result_key(result_key, "texts"))
+        # the summary is shown while it is translated
+        translated_placeholder = st.empty()
+
+        def show_translated(idx: int, translated: str) -> None:
+            """Render the translation of the summary so far"""
+            if idx == 0:
+                translated_placeholder.markdown(translated)
+
+        list_translated = translate_many(
+            texts=list(list_text),
             language=language_to_translate,
-            client=CLIENT,
+            client=get_client(),
             model_name=MODEL_NAME,
             max_tokens=CHUNK_SIZE * 2,
+            store=get_store(),
+            max_workers=MAX_WORKERS,
+            callback=lambda n_done, n_total: progress_bar.progress(
+                n_done / n_total, text=progress_text
+            ),
+            stream_callback=show_translated,
         )
-        progress_bar.progress(
-            1 / (len(st.session_state["list_summary_detail"]) + 1), text=progress_text
+        get_store().put_text(
+            get_result_key(result_key, "translation", language_to_translate),
+            json.dumps(list_translated),
         )
-        st.session_state["summary_translated"] = translated_summary
-        list_summary_detail_translated = []
-        for idx, summary_detail in enumerate(st.session_state["list_summary_detail"]):
-            translated_summary_detail = translate(
-                text=summary_detail,
-                language=language_to_translate,
-                client=CLIENT,
-                model_name=MODEL_NAME,
-                max_tokens=CHUNK_SIZE * 2,
-            )
-            list_summary_detail_translated.append(f"{translated_summary_detail} \n\n")
-            progress_bar.progress(
-                (idx + 2) / (len(st.session_state["list_summary_detail"]) + 1),
-                text=progress_text,
-            )
         progress_bar.empty()
-        st.session_state["list_summary_detail_translated"] = (
-            list_summary_detail_translated
-        )
-
+        st.session_state["translation_language"] = language_to_translate
+        st.session_state.pop("page_translated", None)
         st.rerun()
+
+# Show where the time of the latest runs went
+with st.sidebar:
+    st.subheader("Timing breakdown")
+    list_trace = TRACER.list_trace()
+    if not list_trace:
+        st.caption("Generate a summary to see the time spent in each step.")
+    else:
+        dict_trace = {}
+        for list_span in list_trace:
+            root_span = next(span for span in list_span if span.parent_id is None)
+            label = root_span.name
+            if "title" in root_span.attributes:
+                label += f": {root_span.attributes['title']}"
+            dict_trace[f"{label} ({root_span.duration:.1f} s)"] = list_span
+        trace_label = st.selectbox("Run", list(dict_trace))
+        df_breakdown = pd.DataFrame(get_breakdown(dict_trace[trace_label]))
+        st.dataframe(df_breakdown.round(2), hide_index=True, width="stretch")
+        st.caption(
+            "Wall time of concurrent calls adds up. "
+            f"Spans are also written to {TRACE_FILE_PATH}."
+        )
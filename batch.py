@@ -0,0 +1,339 @@
+import argparse
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date
+from pathlib import Path
+
+import dotenv
+from openai import OpenAI
+from tqdm import tqdm
+
+from modules.article_generator import ArticleGenerator
+from modules.artifact_store import ArtifactStore
+from modules.audio_downloader import SPEECH_MP3, download_and_chunk_audio
+from modules.audio_metadata_retriever import PodcastMetaData, PodcastMetaDataRetriever
+from modules.request_scheduler import ScheduledClient
+from modules.tracer import TRACER, JsonLinesExporter, OtlpExporter, current_span, traced
+from modules.transcriber import LIST_BACKEND, TranscriptionBackend, get_backend
+from modules.translator import translate_many
+
+dotenv.load_dotenv()
+
+# constants
+TRANSCRIBE_MODEL_NAME = "whisper-1"
+MODEL_NAME = "gpt-4o-mini"
+CHUNK_SIZE = 4096
+TARGET_CHUNK_BYTES = 5 * 1024 * 1024
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse the command line arguments"""
+    parser = argparse.ArgumentParser(
+        description="Transcribe and summarize many episodes of a podcast feed"
+    )
+    parser.add_argument("url", help="podcast RSS feed URL")
+    parser.add_argument("--since", type=date.fromisoformat, help="YYYY-MM-DD")
+    parser.add_argument("--until", type=date.fromisoformat, help="YYYY-MM-DD")
+    parser.add_argument("--last", type=int, help="process only the last N episodes")
+    parser.add_argument("--language", help="also translate the summaries")
+    parser.add_argument("--output-dir", type=Path, default=Path("./output/batch"))
+    parser.add_argument(
+        "--checkpoint",
+        type=Path,
+        help="progress file (default: OUTPUT_DIR/checkpoint.json)",
+    )
+    parser.add_argument(
+        "--audio-workers",
+        type=int,
+        default=2,
+        help="processes for downloading and chunking audio",
+    )
+    parser.add_argument(
+        "--episode-workers",
+        type=int,
+        default=4,
+        help="episodes transcribed and summarized at the same time",
+    )
+    parser.add_argument(
+        "--api-workers",
+        type=int,
+        default=8,
+        help="threads for API calls of each episode",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=LIST_BACKEND,
+        default="openai",
+        help="transcription backend; local runs faster-whisper on the CPU",
+    )
+    parser.add_argument(
+        "--local-model",
+        default="small",
+        help="faster-whisper model size of the local backend",
+    )
+    parser.add_argument(
+        "--trace",
+        type=Path,
+        help="append timing spans to this JSON lines file",
+    )
+    return parser.parse_args()
+
+
+def init_tracer(trace_file_path: Path | None) -> None:
+    """Export traces to the file, and to an OTLP/HTTP endpoint if
+    OTEL_EXPORTER_OTLP_ENDPOINT is set. Also run in each audio process,
+    which may have inherited the exporters of the main process.
+    """
+    TRACER.list_exporter = []
+    if trace_file_path is not None:
+        TRACER.add_exporter(JsonLinesExporter(trace_file_path))
+    otlp_endpoint = os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT")
+    if otlp_endpoint is not None:
+        TRACER.add_exporter(OtlpExporter(endpoint=otlp_endpoint))
+
+
+def filter_episodes(
+    list_podcast_metadata: list[PodcastMetaData],
+    since: date | None,
+    until: date | None,
+    last: int | None,
+) -> list[PodcastMetaData]:
+    """Select the episodes published in [since, until], then the last N of them
+    Episodes without a publication date are skipped when a date range is given
+    """
+    list_selected = list_podcast_metadata
+    if since is not None or until is not None:
+        list_selected = [
+            podcast_metadata
+            for podcast_metadata in list_selected
+            if podcast_metadata.pubDate is not None
+            and (since is None or podcast_metadata.pubDate.date() >= since)
+            and (until is None or podcast_metadata.pubDate.date() <= until)
+        ]
+    # list_podcast_metadata is sorted by publication date
+    if last is not None:
+        list_selected = list_selected[-last:] if last > 0 else []
+    return list_selected
+
+
+class Checkpoint:
+    """Stage reached by each episode, saved after every change
+    so that an interrupted run resumes where it stopped
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        if path.exists():
+            with open(path, "r") as f:
+                self.data = json.load(f)
+        else:
+            self.data = {}
+
+    def get(self, episode_id: str) -> dict:
+        """Returns the saved state of the episode"""
+        with self.lock:
+            return dict(self.data.get(episode_id, {}))
+
+    def update(self, episode_id: str, **state: str) -> None:
+        """Merge the state of the episode and save the checkpoint atomically"""
+        with self.lock:
+            self.data.setdefault(episode_id, {}).update(state)
+            tmp_path = self.path.with_suffix(".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(self.data, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+
+@traced("episode")
+def process_episode(
+    podcast_metadata: PodcastMetaData,
+    chunk_dir: Path | None,
+    episode_dir: Path,
+    client: OpenAI,
+    backend: TranscriptionBackend,
+    store: ArtifactStore,
+    checkpoint: Checkpoint,
+    args: argparse.Namespace,
+) -> None:
+    """Transcribe, summarize and translate an episode whose audio is chunked
+    Summaries and translations are kept in the artifact store, so an episode
+    that was interrupted after its transcription only pays for missing calls.
+    """
+    current_span().set(title=podcast_metadata.title, url=podcast_metadata.enclosure)
+    transcript_file_path = episode_dir / "transcript.txt"
+    if checkpoint.get(podcast_metadata.id).get("stage") == "transcribed":
+        with open(transcript_file_path, "r") as f:
+            transcript = f.read()
+    else:
+        list_transcript = backend.transcribe_many(
+            list_audio_file_path=sorted(chunk_dir.glob("audio_*")),
+            max_workers=args.api_workers,
+        )
+        transcript = "".join(list_transcript)
+        with open(transcript_file_path, "w") as f:
+            f.write(transcript)
+        checkpoint.update(podcast_metadata.id, stage="transcribed")
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+
+    article_generator = ArticleGenerator(
+        title=podcast_metadata.title,
+        client=client,
+        model_name=MODEL_NAME,
+        chunk_size=CHUNK_SIZE,
+        text=transcript,
+        store=store,
+    )
+    list_summary_detail = article_generator.get_list_summary(
+        max_tokens=CHUNK_SIZE * 2, max_workers=args.api_workers
+    )
+    summary = article_generator.summarize_summaries(
+        texts=list_summary_detail,
+        max_tokens=CHUNK_SIZE * 2,
+        max_workers=args.api_workers,
+    )
+    with open(episode_dir / "summary_detail.md", "w") as f:
+        f.write("".join(list_summary_detail))
+    with open(episode_dir / "summary.md", "w") as f:
+        f.write(summary)
+
+    if args.language is not None:
+        list_translated = translate_many(
+            texts=[summary] + list_summary_detail,
+            language=args.language,
+            client=client,
+            model_name=MODEL_NAME,
+            max_tokens=CHUNK_SIZE * 2,
+            store=store,
+            max_workers=args.api_workers,
+        )
+        with open(episode_dir / f"summary.{args.language}.md", "w") as f:
+            f.write(list_translated[0])
+        with open(episode_dir / f"summary_detail.{args.language}.md", "w") as f:
+            f.write("\n\n".join(list_translated[1:]))
+
+    checkpoint.update(podcast_metadata.id, stage="done")
+
+
+def main() -> None:
+    args = parse_args()
+    init_tracer(args.trace)
+    # episodes share the rate limits of the account
+    client = ScheduledClient(OpenAI(api_key=os.environ.get("OPENAI_API_KEY")))
+    # a local backend shares one pool of model processes between episodes
+    backend = get_backend(
+        args.backend,
+        client=client,
+        model_name=(
+            args.local_model if args.backend == "local" else TRANSCRIBE_MODEL_NAME
+        ),
+    )
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    work_dir = args.output_dir / "work"
+    store = ArtifactStore(args.output_dir / "store")
+    checkpoint = Checkpoint(args.checkpoint or args.output_dir / "checkpoint.json")
+
+    podcast_metadata_collection = PodcastMetaDataRetriever(args.url).get_data()
+    list_podcast_metadata = filter_episodes(
+        podcast_metadata_collection.list_podcast_metadata,
+        since=args.since,
+        until=args.until,
+        last=args.last,
+    )
+    list_todo = [
+        podcast_metadata
+        for podcast_metadata in list_podcast_metadata
+        if checkpoint.get(podcast_metadata.id).get("stage") != "done"
+    ]
+    print(
+        f"{len(list_podcast_metadata)} episodes selected, "
+        f"{len(list_podcast_metadata) - len(list_todo)} already done"
+    )
+
+    progress_bar = tqdm(total=len(list_todo))
+    with (
+        ProcessPoolExecutor(
+            max_workers=args.audio_workers,
+            initializer=init_tracer,
+            initargs=(args.trace,),
+        ) as audio_executor,
+        ThreadPoolExecutor(max_workers=args.episode_workers) as episode_executor,
+    ):
+
+        def on_audio_done(podcast_metadata: PodcastMetaData, episode_dir: Path):
+            def callback(future: Future) -> None:
+                try:
+                    chunk_dir = future.result()
+                except Exception as e:
+                    tqdm.write(f"Failed {podcast_metadata.title}: {e!r}")
+                    progress_bar.update(1)
+                    return
+                checkpoint.update(
+                    podcast_metadata.id, stage="chunked", chunk_dir=str(chunk_dir)
+                )
+                submit_api(podcast_metadata, chunk_dir, episode_dir)
+
+            return callback
+
+        def on_episode_done(podcast_metadata: PodcastMetaData):
+            def callback(future: Future) -> None:
+                try:
+                    future.result()
+                except Exception as e:
+                    tqdm.write(f"Failed {podcast_metadata.title}: {e!r}")
+                progress_bar.update(1)
+
+            return callback
+
+        def submit_api(
+            podcast_metadata: PodcastMetaData,
+            chunk_dir: Path | None,
+            episode_dir: Path,
+        ) -> None:
+            future = episode_executor.submit(
+                process_episode,
+                podcast_metadata,
+                chunk_dir,
+                episode_dir,
+                client,
+                backend,
+                store,
+                checkpoint,
+                args,
+            )
+            future.add_done_callback(on_episode_done(podcast_metadata))
+
+        for podcast_metadata in list_todo:
+            pub_date = (
+                podcast_metadata.pubDate.strftime("%Y%m%d")
+                if podcast_metadata.pubDate is not None
+                else "nodate"
+            )
+            episode_dir = args.output_dir / f"{pub_date}_{podcast_metadata.id}"
+            episode_dir.mkdir(exist_ok=True)
+            state = checkpoint.get(podcast_metadata.id)
+            if state.get("stage") == "transcribed":
+                submit_api(podcast_metadata, None, episode_dir)
+            elif state.get("stage") == "chunked" and Path(state["chunk_dir"]).exists():
+                submit_api(podcast_metadata, Path(state["chunk_dir"]), episode_dir)
+            else:
+                future = audio_executor.submit(
+                    download_and_chunk_audio,
+                    url=podcast_metadata.enclosure,
+                    title=podcast_metadata.id,
+                    output_dir=work_dir,
+                    profile=SPEECH_MP3,
+                    target_chunk_bytes=TARGET_CHUNK_BYTES,
+                )
+                future.add_done_callback(on_audio_done(podcast_metadata, episode_dir))
+        # the audio pool is shut down first, so every episode is submitted
+        audio_executor.shutdown(wait=True)
+    progress_bar.close()
+    backend.close()
+
+
+if __name__ == "__main__":
+    main()
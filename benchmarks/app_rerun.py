@@ -0,0 +1,110 @@
+import argparse
+import json
+import os
+import statistics
+import time
+from pathlib import Path
+
+from benchmarks.fixtures import make_fixtures
+from benchmarks.stub_server import StubConfig, start_stub_server
+
+SEARCH_QUERIES = ["benchmark episode 42", "synthetic minutes"]
+APP_FILE_PATH = Path(__file__).resolve().parent.parent / "app.py"
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse the command line arguments"""
+    parser = argparse.ArgumentParser(
+        description="Time reruns of the Streamlit app that have no work to do, "
+        "with a feed served by the local stub"
+    )
+    parser.add_argument("--reruns", type=int, default=50)
+    parser.add_argument("--feed-items", type=int, default=500)
+    parser.add_argument(
+        "--fixture-dir", type=Path, default=Path("./output/benchmarks/fixtures")
+    )
+    parser.add_argument("--json", type=Path, help="also write the report here")
+    return parser.parse_args()
+
+
+def get_summary_ms(list_seconds: list[float]) -> dict[str, float]:
+    """Returns the p50/p90/max milliseconds of the runs"""
+    # imported once the runs are timed, as it imports the pipeline modules
+    # that the first run of the app should pay for
+    from benchmarks.run import percentile
+
+    return {
+        "p50": statistics.median(list_seconds) * 1000,
+        "p90": percentile(list_seconds, 90) * 1000,
+        "max": max(list_seconds) * 1000,
+    }
+
+
+def time_run(app_test, n: int = 1) -> list[float]:
+    """Returns the seconds of each of n runs of the app script"""
+    list_seconds = []
+    for _ in range(n):
+        time_start = time.perf_counter()
+        app_test.run()
+        list_seconds.append(time.perf_counter() - time_start)
+        if app_test.exception:
+            raise Exception(app_test.exception[0].message)
+    return list_seconds
+
+
+def main() -> None:
+    args = parse_args()
+    server, _ = start_stub_server(StubConfig(), args.fixture_dir)
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    args.fixture_dir.mkdir(parents=True, exist_ok=True)
+    feed_url = make_fixtures(args.fixture_dir, base_url, [5], args.feed_items)
+    os.environ["OPENAI_API_KEY"] = "stub"
+    os.environ["OPENAI_BASE_URL"] = f"{base_url}/v1"
+
+    # imported here, so that the first run pays for the imports of the app
+    from streamlit.testing.v1 import AppTest
+
+    app_test = AppTest.from_file(str(APP_FILE_PATH), default_timeout=60)
+    # the first run imports the modules of the app and parses the feed
+    app_test.session_state["url"] = feed_url
+    first_seconds = time_run(app_test)[0]
+    list_rerun_seconds = time_run(app_test, args.reruns)
+    list_select_seconds = []
+    for idx in range(1, min(args.reruns, args.feed_items, 20)):
+        app_test.selectbox[0].select_index(idx)
+        list_select_seconds.extend(time_run(app_test))
+    # searches typed one character at a time, and paging through the results
+    list_search_seconds = []
+    for query in SEARCH_QUERIES:
+        for n in range(1, len(query) + 1):
+            app_test.text_input(key="query").input(query[:n])
+            list_search_seconds.extend(time_run(app_test))
+    list_page_seconds = []
+    app_test.text_input(key="query").input("episode")
+    time_run(app_test)
+    for page in range(2, args.reruns + 2):
+        app_test.number_input(key="page").set_value(page)
+        list_page_seconds.extend(time_run(app_test))
+    server.shutdown()
+
+    report = {
+        "feed_items": args.feed_items,
+        "first_run_seconds": first_seconds,
+        "rerun_ms": get_summary_ms(list_rerun_seconds),
+        "select_episode_ms": get_summary_ms(list_select_seconds),
+        "search_ms": get_summary_ms(list_search_seconds),
+        "page_ms": get_summary_ms(list_page_seconds),
+    }
+    print(f"First run {first_seconds:.2f} s")
+    for name in ["rerun_ms", "select_episode_ms", "search_ms", "page_ms"]:
+        print(
+            f"{name:<18} p50 {report[name]['p50']:7.1f}  "
+            f"p90 {report[name]['p90']:7.1f}  max {report[name]['max']:7.1f}"
+        )
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+import ffmpeg
+
+# a 220 Hz tone switched on and off every few seconds, so that silence
+# detection finds pauses as it would in speech
+SPEECH_LIKE_EXPR = "0.5*sin(2*PI*220*t)*gt(sin(2*PI*t/7)+0.3*sin(2*PI*t/2.3),-0.2)"
+
+
+def make_audio(file_path: Path, seconds: int, bit_rate: int = 64000) -> Path:
+    """Write a mono mp3 of the given length, unless it exists already"""
+    if not file_path.exists():
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        partial_path = file_path.with_suffix(".part.mp3")
+        (
+            ffmpeg.input(
+                f"aevalsrc='{SPEECH_LIKE_EXPR}':s=16000:d={seconds}", f="lavfi"
+            )
+            .output(str(partial_path), ac=1, audio_bitrate=bit_rate)
+            .overwrite_output()
+            .run(quiet=True)
+        )
+        partial_path.rename(file_path)
+    return file_path
+
+
+def make_feed(
+    file_path: Path, list_episode: list[tuple[str, int]], n_items: int
+) -> Path:
+    """Write an RSS feed of n_items episodes, cycling over (url, seconds)
+    The newest episode uses the first url.
+    """
+    published = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    list_item = []
+    for i in range(n_items):
+        url, seconds = list_episode[i % len(list_episode)]
+        pub_date = format_datetime(published - timedelta(days=i))
+        list_item.append(f"""    <item>
+      <title>{escape(f"Benchmark episode {n_items - i}")}</title>
+      <guid isPermaLink="false">benchmark-{n_items - i}</guid>
+      <pubDate>{pub_date}</pubDate>
+      <enclosure url="{escape(url)}" length="0" type="audio/mpeg"/>
+      <itunes:duration>{seconds}</itunes:duration>
+      <itunes:author>Benchmark</itunes:author>
+      <description>{escape(f"Synthetic episode of {seconds // 60} minutes.")}</description>
+    </item>
+""")
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(file_path, "w") as f:
+        f.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<rss version="2.0" '
+            'xmlns:itunes="http://www.itunes.com/dtds/podcast-1.0.dtd">\n'
+            "  <channel>\n"
+            "    <title>Benchmark feed</title>\n"
+            + "".join(list_item)
+            + "  </channel>\n</rss>\n"
+        )
+    return file_path
+
+
+def make_fixtures(
+    fixture_dir: Path, base_url: str, list_minutes: list[int], n_items: int
+) -> str:
+    """Write audio of each length and a feed of n_items episodes using them
+    Returns the url of the feed under base_url, which serves fixture_dir
+    """
+    list_episode = []
+    for minutes in list_minutes:
+        file_name = f"audio_{minutes}min.mp3"
+        make_audio(fixture_dir / file_name, minutes * 60)
+        list_episode.append((f"{base_url}/{file_name}", minutes * 60))
+    feed_name = f"feed_{'_'.join(map(str, list_minutes))}_{n_items}.xml"
+    make_feed(fixture_dir / feed_name, list_episode, n_items)
+    return f"{base_url}/{feed_name}"
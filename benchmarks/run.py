@@ -0,0 +1,247 @@
+import argparse
+import json
+import resource
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from openai import OpenAI
+
+from benchmarks.fixtures import make_fixtures
+from benchmarks.stub_server import StubConfig, start_stub_server
+from modules.artifact_store import ArtifactStore
+from modules.audio_downloader import SPEECH_MP3
+from modules.audio_metadata_retriever import PodcastMetaData, PodcastMetaDataRetriever
+from modules.pipeline import EpisodePipeline
+from modules.request_scheduler import ScheduledClient
+from modules.tracer import TRACER, Span
+from modules.transcriber import LIST_BACKEND, TranscriptionBackend, get_backend
+from modules.translator import translate_many
+
+MODEL_NAME = "gpt-4o-mini"
+TRANSCRIBE_MODEL_NAME = "whisper-1"
+CHUNK_SIZE = 4096
+TARGET_CHUNK_BYTES = 5 * 1024 * 1024
+
+
+class SpanCollector:
+    """Exporter keeping every span of the run, unlike the bounded tracer"""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.list_span: list[Span] = []
+
+    def export(self, list_span: list[Span]) -> None:
+        with self.lock:
+            self.list_span.extend(list_span)
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse the command line arguments"""
+    parser = argparse.ArgumentParser(
+        description="Run episodes through the real pipeline against a local "
+        "OpenAI-compatible stub and report throughput and latencies"
+    )
+    parser.add_argument(
+        "--minutes",
+        type=int,
+        nargs="+",
+        default=[5, 20, 60],
+        help="lengths of the generated audio fixtures",
+    )
+    parser.add_argument("--episodes", type=int, default=3)
+    parser.add_argument("--feed-items", type=int, default=500)
+    parser.add_argument("--episode-workers", type=int, default=1)
+    parser.add_argument("--max-workers", type=int, default=8)
+    parser.add_argument("--language", help="also translate the summaries")
+    parser.add_argument(
+        "--fixture-dir", type=Path, default=Path("./output/benchmarks/fixtures")
+    )
+    parser.add_argument("--json", type=Path, help="also write the report here")
+    parser.add_argument(
+        "--backend",
+        choices=LIST_BACKEND,
+        default="openai",
+        help="transcription backend; openai calls the stub API",
+    )
+    parser.add_argument(
+        "--local-model",
+        default="small",
+        help="faster-whisper model size of the local backend",
+    )
+    parser.add_argument(
+        "--no-scheduler",
+        action="store_true",
+        help="call the API without the rate-limit-aware scheduler",
+    )
+    stub = parser.add_argument_group("stub API")
+    stub.add_argument("--transcribe-latency", type=float, default=0.5)
+    stub.add_argument("--transcribe-rtf", type=float, default=0.005)
+    stub.add_argument("--first-token-latency", type=float, default=0.3)
+    stub.add_argument("--tokens-per-second", type=float, default=200.0)
+    stub.add_argument("--completion-tokens", type=int, default=300)
+    stub.add_argument("--rpm", type=int, default=0, help="0 for no rate limit")
+    return parser.parse_args()
+
+
+def percentile(list_value: list[float], q: float) -> float:
+    """Returns the q-th percentile (0-100) by nearest rank"""
+    list_sorted = sorted(list_value)
+    rank = max(0, min(len(list_sorted) - 1, round(q / 100 * len(list_sorted)) - 1))
+    return list_sorted[rank]
+
+
+def get_latency_table(list_span: list[Span]) -> list[dict]:
+    """Returns the count and p50/p90/p99/max seconds of the spans of each name"""
+    dict_duration: dict[str, list[float]] = {}
+    for span in list_span:
+        dict_duration.setdefault(span.name, []).append(span.duration)
+    return [
+        {
+            "name": name,
+            "count": len(list_duration),
+            "p50": percentile(list_duration, 50),
+            "p90": percentile(list_duration, 90),
+            "p99": percentile(list_duration, 99),
+            "max": max(list_duration),
+        }
+        for name, list_duration in sorted(
+            dict_duration.items(), key=lambda item: -sum(item[1])
+        )
+    ]
+
+
+def run_episode(
+    podcast_metadata: PodcastMetaData,
+    client: OpenAI,
+    backend: TranscriptionBackend,
+    tmp_dir: Path,
+    args: argparse.Namespace,
+) -> None:
+    """Generate the summaries of an episode, and translate them if asked
+    Each episode gets an empty store, so that episodes sharing a fixture
+    still pay for all of their work.
+    """
+    store = ArtifactStore(tmp_dir / podcast_metadata.id / "store")
+    episode_pipeline = EpisodePipeline(
+        client=client,
+        store=store,
+        transcribe_model_name=TRANSCRIBE_MODEL_NAME,
+        model_name=MODEL_NAME,
+        chunk_size=CHUNK_SIZE,
+        profile=SPEECH_MP3,
+        target_chunk_bytes=TARGET_CHUNK_BYTES,
+        max_workers=args.max_workers,
+        transcription_backend=backend,
+    )
+    pipeline_result = episode_pipeline.run(
+        url=podcast_metadata.enclosure,
+        title=podcast_metadata.title,
+        work_dir=tmp_dir / podcast_metadata.id / "work",
+    )
+    if args.language is not None:
+        translate_many(
+            texts=[pipeline_result.summary] + pipeline_result.list_summary_detail,
+            language=args.language,
+            client=client,
+            model_name=MODEL_NAME,
+            max_tokens=CHUNK_SIZE * 2,
+            store=store,
+            max_workers=args.max_workers,
+        )
+
+
+def main() -> None:
+    args = parse_args()
+    config = StubConfig(
+        transcribe_latency=args.transcribe_latency,
+        transcribe_rtf=args.transcribe_rtf,
+        audio_bytes_per_second=SPEECH_MP3.bit_rate // 8,
+        first_token_latency=args.first_token_latency,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens,
+        rpm=args.rpm,
+    )
+    server, stats = start_stub_server(config, args.fixture_dir)
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    args.fixture_dir.mkdir(parents=True, exist_ok=True)
+    time_start = time.perf_counter()
+    feed_url = make_fixtures(args.fixture_dir, base_url, args.minutes, args.feed_items)
+    print(f"Fixtures ready in {time.perf_counter() - time_start:.1f} s")
+
+    client = OpenAI(api_key="stub", base_url=f"{base_url}/v1")
+    if not args.no_scheduler:
+        client = ScheduledClient(client)
+    backend = get_backend(
+        args.backend,
+        client=client,
+        model_name=(
+            args.local_model if args.backend == "local" else TRANSCRIBE_MODEL_NAME
+        ),
+    )
+    collector = SpanCollector()
+    TRACER.add_exporter(collector)
+
+    time_start = time.perf_counter()
+    podcast_metadata_collection = PodcastMetaDataRetriever(feed_url).get_data()
+    feed_seconds = time.perf_counter() - time_start
+    # the newest episodes cycle over the fixture lengths
+    list_podcast_metadata = podcast_metadata_collection.list_podcast_metadata[::-1][
+        : args.episodes
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        time_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.episode_workers) as executor:
+            list(
+                executor.map(
+                    lambda podcast_metadata: run_episode(
+                        podcast_metadata, client, backend, Path(tmp_dir), args
+                    ),
+                    list_podcast_metadata,
+                )
+            )
+        wall_seconds = time.perf_counter() - time_start
+    backend.close()
+    server.shutdown()
+
+    report = {
+        "episodes": len(list_podcast_metadata),
+        "backend": backend.key,
+        "wall_seconds": wall_seconds,
+        "episodes_per_hour": len(list_podcast_metadata) / wall_seconds * 3600,
+        "feed_items": len(podcast_metadata_collection.list_podcast_metadata),
+        "feed_seconds": feed_seconds,
+        # ru_maxrss is in KiB on Linux; children are the ffmpeg processes
+        "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "peak_child_rss_mib": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        / 1024,
+        "stub_requests": stats.dict_count,
+        "latency": get_latency_table(collector.list_span),
+    }
+
+    print(
+        f"{report['episodes']} episodes in {wall_seconds:.1f} s: "
+        f"{report['episodes_per_hour']:.1f} episodes/hour"
+    )
+    print(f"Feed of {report['feed_items']} items parsed in {feed_seconds:.2f} s")
+    print(
+        f"Peak RSS {report['peak_rss_mib']:.0f} MiB "
+        f"(ffmpeg {report['peak_child_rss_mib']:.0f} MiB)"
+    )
+    print(f"Stub requests {stats.dict_count}")
+    print(f"{'span':<22}{'count':>7}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}")
+    for row in report["latency"]:
+        print(
+            f"{row['name']:<22}{row['count']:>7}{row['p50']:>9.3f}"
+            f"{row['p90']:>9.3f}{row['p99']:>9.3f}{row['max']:>9.3f}"
+        )
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
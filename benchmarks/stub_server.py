@@ -0,0 +1,278 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+WORDS = (
+    "the podcast guest talks about science history music and the news "
+    "of the week while the host asks questions about their new book"
+).split()
+SEGMENT_MARKER_PATTERN = re.compile(r"^=== SEGMENT \d+ ===$", re.MULTILINE)
+
+
+@dataclass
+class StubConfig:
+    """Simulated behaviour of the API
+    Latencies are in seconds. rpm is the number of requests allowed in any
+    60 second window (0 for no limit); requests over it get a 429.
+    """
+
+    transcribe_latency: float = 0.5
+    # seconds of latency per second of uploaded audio
+    transcribe_rtf: float = 0.005
+    # bytes per second of the uploaded audio, to derive its duration
+    audio_bytes_per_second: int = 4000
+    words_per_second: float = 2.5
+    first_token_latency: float = 0.3
+    tokens_per_second: float = 200.0
+    completion_tokens: int = 300
+    rpm: int = 0
+
+
+class StubStats:
+    """Counts of the requests served by the stub"""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.dict_count: dict[str, int] = {}
+
+    def add(self, name: str) -> None:
+        with self.lock:
+            self.dict_count[name] = self.dict_count.get(name, 0) + 1
+
+
+class RateLimiter:
+    """Sliding window of the times of the last rpm requests"""
+
+    def __init__(self, rpm: int) -> None:
+        self.rpm = rpm
+        self.lock = threading.Lock()
+        self.times: deque[float] = deque()
+
+    def acquire(self) -> float:
+        """Returns 0 if the request is allowed, or the seconds to wait"""
+        if self.rpm <= 0:
+            return 0.0
+        now = time.monotonic()
+        with self.lock:
+            while self.times and now - self.times[0] >= 60:
+                self.times.popleft()
+            if len(self.times) >= self.rpm:
+                return 60 - (now - self.times[0])
+            self.times.append(now)
+            return 0.0
+
+    def headers(self) -> dict[str, str]:
+        """Returns the x-ratelimit-* headers of the requests limit"""
+        if self.rpm <= 0:
+            return {}
+        now = time.monotonic()
+        with self.lock:
+            while self.times and now - self.times[0] >= 60:
+                self.times.popleft()
+            reset = 60 - (now - self.times[0]) if self.times else 0.0
+            return {
+                "x-ratelimit-limit-requests": str(self.rpm),
+                "x-ratelimit-remaining-requests": str(self.rpm - len(self.times)),
+                "x-ratelimit-reset-requests": f"{reset:.3f}s",
+            }
+
+
+def _make_text(n_words: int, seed: int) -> str:
+    """Returns n_words of sentence-like text, the same for the same seed"""
+    rng = random.Random(seed)
+    list_sentence = []
+    while n_words > 0:
+        n = min(n_words, rng.randint(6, 16))
+        list_sentence.append(" ".join(rng.choice(WORDS) for _ in range(n)) + ".")
+        n_words -= n
+    return " ".join(list_sentence).capitalize()
+
+
+class StubHandler(SimpleHTTPRequestHandler):
+    """OpenAI-compatible /v1/audio/transcriptions and /v1/chat/completions,
+    and the files of the fixture directory for any other GET
+    """
+
+    protocol_version = "HTTP/1.1"
+    config: StubConfig
+    stats: StubStats
+    rate_limiter: RateLimiter
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def _send_json(self, status: int, body: dict, headers: dict | None = None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (self.rate_limiter.headers() | (headers or {})).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_event(self, body: dict | str) -> None:
+        """Write a server-sent event as one chunk of a chunked response"""
+        if isinstance(body, dict):
+            body = json.dumps(body)
+        data = f"data: {body}\n\n".encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        wait = self.rate_limiter.acquire()
+        if wait > 0:
+            self.stats.add("rate_limited")
+            self._send_json(
+                429,
+                {"error": {"message": "Rate limit reached", "type": "requests"}},
+                headers={"retry-after-ms": str(int(wait * 1000))},
+            )
+            return
+        if self.path.endswith("/audio/transcriptions"):
+            self._transcribe(body)
+        elif self.path.endswith("/chat/completions"):
+            self._chat(json.loads(body))
+        else:
+            self._send_json(404, {"error": {"message": f"No route {self.path}"}})
+
+    def _transcribe(self, body: bytes) -> None:
+        self.stats.add("transcriptions")
+        audio_seconds = len(body) / self.config.audio_bytes_per_second
+        time.sleep(
+            self.config.transcribe_latency + audio_seconds * self.config.transcribe_rtf
+        )
+        n_words = int(audio_seconds * self.config.words_per_second)
+        self._send_json(200, {"text": _make_text(n_words, seed=len(body))})
+
+    def _chat(self, request: dict) -> None:
+        self.stats.add("chat_completions")
+        prompt = "".join(message["content"] for message in request["messages"])
+        max_tokens = request.get("max_tokens") or self.config.completion_tokens
+        n_tokens = min(self.config.completion_tokens, max_tokens)
+        finish_reason = "stop" if n_tokens < max_tokens else "length"
+        # keep the segment markers of batched translations
+        list_marker = SEGMENT_MARKER_PATTERN.findall(prompt)
+        if list_marker:
+            n_words = max(1, n_tokens // len(list_marker))
+            content = "\n".join(
+                f"{marker}\n{_make_text(n_words, seed=i)}"
+                for i, marker in enumerate(list_marker)
+            )
+        else:
+            content = _make_text(n_tokens, seed=len(prompt))
+        usage = {
+            "prompt_tokens": len(prompt) // 4,
+            "completion_tokens": n_tokens,
+            "total_tokens": len(prompt) // 4 + n_tokens,
+        }
+        chunk_base = {
+            "id": "chatcmpl-stub",
+            "created": int(time.time()),
+            "model": request["model"],
+        }
+
+        time.sleep(self.config.first_token_latency)
+        if not request.get("stream"):
+            time.sleep(n_tokens / self.config.tokens_per_second)
+            self._send_json(
+                200,
+                chunk_base
+                | {
+                    "object": "chat.completion",
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": finish_reason,
+                        }
+                    ],
+                    "usage": usage,
+                },
+            )
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        for key, value in self.rate_limiter.headers().items():
+            self.send_header(key, value)
+        self.end_headers()
+        # one word is sent per token
+        for piece in re.findall(r"\S+\s*", content):
+            self._send_event(
+                chunk_base
+                | {
+                    "object": "chat.completion.chunk",
+                    "choices": [
+                        {"index": 0, "delta": {"content": piece}, "finish_reason": None}
+                    ],
+                }
+            )
+            time.sleep(1 / self.config.tokens_per_second)
+        self._send_event(
+            chunk_base
+            | {
+                "object": "chat.completion.chunk",
+                "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}],
+            }
+        )
+        if (request.get("stream_options") or {}).get("include_usage"):
+            self._send_event(
+                chunk_base
+                | {"object": "chat.completion.chunk", "choices": [], "usage": usage}
+            )
+        self._send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def start_stub_server(
+    config: StubConfig, fixture_dir: Path, port: int = 0
+) -> tuple[ThreadingHTTPServer, StubStats]:
+    """Serve the stub API and the fixture files in a background thread
+    Returns the server, whose port is server.server_port, and its stats
+    """
+    stats = StubStats()
+    handler = type(
+        "Handler",
+        (StubHandler,),
+        {
+            "config": config,
+            "stats": stats,
+            "rate_limiter": RateLimiter(config.rpm),
+        },
+    )
+
+    def make_handler(*args, **kwargs) -> StubHandler:
+        return handler(*args, directory=str(fixture_dir), **kwargs)
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Run the stub API alone, e.g. for the app with "
+        "OPENAI_BASE_URL=http://127.0.0.1:8000/v1"
+    )
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--fixture-dir", type=Path, default=Path("."))
+    parser.add_argument("--rpm", type=int, default=0)
+    args = parser.parse_args()
+    server, _ = start_stub_server(StubConfig(rpm=args.rpm), args.fixture_dir, args.port)
+    print(f"Serving the stub API on http://127.0.0.1:{server.server_port}/v1")
+    threading.Event().wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,21 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterator
+
 from openai import OpenAI
 
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from tqdm import tqdm
+from modules.artifact_store import ArtifactStore, hash_text
+from modules.chat_stream import ChatStream, add_usage
+from modules.text_splitter import TokenWindowSplitter
+from modules.tokenizer import count_tokens, get_encoding
+from modules.tracer import bind_span, span
+
+# bump when a prompt changes so that stored summaries are not reused
+PROMPT_VERSION = "1"
+# tokens kept free in each batch of summaries to reduce, as the pieces of a
+# batch can encode to a few more tokens once they are joined
+REDUCE_MARGIN_TOKENS = 8
+# tokens that each piece of a batch may gain where it meets the next one
+PIECE_MARGIN_TOKENS = 2
 
 
 class ArticleGenerator:
@@ -10,32 +24,95 @@ class ArticleGenerator:
     def __init__(
         self,
         title: str,
-        text: str,
         client: OpenAI,
         model_name: str,
         chunk_size: int,
         chunk_overlap: int = 0,
+        text: str = "",
+        store: ArtifactStore | None = None,
+        context_window: int = 128000,
     ) -> None:
         self.model_name = model_name
+        self.store = store
+        self.context_window = context_window
         self.client = client
         self.title = title
         self.text = text
-        self.list_split_text = self._split_text(
-            chunk_size=chunk_size, chunk_overlap=chunk_overlap
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.list_split_text = self.split_text(self.text)
+
+    def make_text_splitter(self) -> TokenWindowSplitter:
+        """Returns a splitter into windows of chunk_size tokens
+        Feed it transcript pieces to get windows before the transcript is complete
+        """
+        return TokenWindowSplitter(
+            model_name=self.model_name,
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap,
         )
 
-    def _split_text(self, chunk_size: int, chunk_overlap: int) -> list[str]:
+    def split_text(self, text: str) -> list[str]:
         """Split the text into multiple documents"""
-        text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
-            model_name=self.model_name,
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
+        return self.make_text_splitter().split_text(text)
+
+    def _store_key(self, kind: str, user_message: str, max_tokens: int) -> str:
+        """Returns the store key of the completion of the message"""
+        return ArtifactStore.make_key(
+            kind,
+            hash_text(user_message),
+            self.model_name,
+            PROMPT_VERSION,
+            max_tokens,
         )
-        texts = text_splitter.split_text(self.text)
-        return texts
 
-    def summarize_transcript(self, title: str, text: str, max_tokens: int) -> str:
-        """Generate summary from the transcript"""
+    def _complete(self, kind: str, user_message: str, max_tokens: int) -> str:
+        """Get a chat completion for the message, using the store if it is set"""
+        if self.store is not None:
+            key = self._store_key(kind, user_message, max_tokens)
+            content = self.store.get_text(key)
+            if content is not None:
+                return content
+
+        with span(kind, model=self.model_name) as chat_span:
+            res = self.client.chat.completions.create(
+                model=self.model_name,
+                messages=[{"role": "user", "content": user_message}],
+                max_tokens=max_tokens,
+            )
+            add_usage(chat_span, res.usage)
+        content = res.choices[0].message.content
+
+        if self.store is not None:
+            self.store.put_text(key, content)
+        return content
+
+    def _complete_stream(
+        self, kind: str, user_message: str, max_tokens: int
+    ) -> Iterator[str]:
+        """Yield a chat completion for the message as it is generated
+        A stored completion is yielded at once. The completion is stored
+        only when the stream has been read to the end.
+        """
+        if self.store is not None:
+            key = self._store_key(kind, user_message, max_tokens)
+            content = self.store.get_text(key)
+            if content is not None:
+                yield content
+                return
+
+        list_piece = []
+        for piece in ChatStream(
+            self.client, self.model_name, user_message, max_tokens, span_name=kind
+        ):
+            list_piece.append(piece)
+            yield piece
+
+        if self.store is not None:
+            self.store.put_text(key, "".join(list_piece))
+
+    def _transcript_message(self, title: str, text: str) -> str:
+        """Returns the prompt to summarize a segment of the transcript"""
         user_message = f"""
         Your task is to expertly summarize the content of a podcast.
         The podcast title is {title}. 
@@ -52,29 +129,66 @@ class ArticleGenerator:
 
         {text}
         """
+        return user_message
 
-        res = self.client.chat.completions.create(
-            model=self.model_name,
-            messages=[{"role": "user", "content": user_message}],
+    def summarize_transcript(self, title: str, text: str, max_tokens: int) -> str:
+        """Generate summary from the transcript"""
+        return self._complete(
+            kind="summary",
+            user_message=self._transcript_message(title, text),
             max_tokens=max_tokens,
         )
 
-        return res.choices[0].message.content
+    def stream_summarize_transcript(
+        self, title: str, text: str, max_tokens: int
+    ) -> Iterator[str]:
+        """Generate summary from the transcript, yielding it as it is generated"""
+        return self._complete_stream(
+            kind="summary",
+            user_message=self._transcript_message(title, text),
+            max_tokens=max_tokens,
+        )
 
-    def get_list_summary(self, max_tokens: int) -> list[str]:
-        """Generate summaries from transcripts"""
-        list_article = []
-        for text in tqdm(self.list_split_text):
-            article = self._summarize_transcript(
-                text=text, title=self.title, max_tokens=max_tokens
-            )
+    def get_list_summary(
+        self,
+        max_tokens: int,
+        max_workers: int = 8,
+        callback: Callable[[int, int], None] | None = None,
+    ) -> list[str]:
+        """Generate summaries from transcripts concurrently, in segment order
+        callback is called with (number of finished segments, number of segments)
+        in the caller's thread each time a segment finishes
+        """
+        list_article: list[str | None] = [None] * len(self.list_split_text)
+        if not self.list_split_text:
+            return []
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            future_to_idx = {
+                executor.submit(
+                    bind_span(self.summarize_transcript),
+                    text=text,
+                    title=self.title,
+                    max_tokens=max_tokens,
+                ): idx
+                for idx, text in enumerate(self.list_split_text)
+            }
+            for n_done, future in enumerate(as_completed(future_to_idx), start=1):
+                list_article[future_to_idx[future]] = f"{future.result()} \n\n"
+                if callback is not None:
+                    callback(n_done, len(self.list_split_text))
 
-            list_article.append(f"{article} \n\n")
         return list_article
 
-    def summarize_summaries(self, texts: list[str], max_tokens: int) -> str:
-        """Summarize the summaries"""
-        summaries = "".join(texts)
+    def _summaries_message(self, summaries: str, is_final: bool) -> str:
+        """Returns the prompt to summarize a combination of summaries
+        Only the final summary gets a title header, so that intermediate
+        summaries of a hierarchical reduction can be combined again.
+        """
+        if is_final:
+            title_format = "Summary should start with title header '##'."
+        else:
+            title_format = "Do not add title header of the summary, just the sections."
 
         user_message = f"""
         You are a professional summarizer.
@@ -84,17 +198,101 @@ class ArticleGenerator:
         - Preserve the Tone: Maintain the atmosphere and style of the original summaries. Whether the content is serious, humorous, or of any other tone, your summary should reflect that.
         - Language Consistency: The summary should be in the same language as the provided text.
         - Topic-Based Organization: Structure your summary by dividing it into sections based on the different topics covered in the summaries.
-        - Format: The output should be in markdown format. Each section should start with a header '###' and the header should be the topic of the section. Summary should start with title header '##'.
+        - Format: The output should be in markdown format. Each section should start with a header '###' and the header should be the topic of the section. {title_format}
         
         Here are the combination of summaries you need to summarize:
 
         {summaries}
         """
+        return user_message
+
+    def _group_by_tokens(self, texts: list[str], budget: int) -> list[list[str]]:
+        """Group consecutive texts into batches of at most budget tokens
+        A text longer than budget is cut into pieces on token boundaries.
+        Each piece is counted with PIECE_MARGIN_TOKENS more, for the tokens
+        that can change where pieces are joined and encoded again.
+        """
+        encoding = get_encoding(self.model_name)
+        piece_size = budget - PIECE_MARGIN_TOKENS
+        list_batch: list[list[str]] = []
+        n_batch_tokens = 0
+        for text in texts:
+            tokens = encoding.encode(text, disallowed_special=())
+            for start in range(0, len(tokens), piece_size):
+                n_piece_tokens = len(tokens[start : start + piece_size])
+                n_piece_tokens += PIECE_MARGIN_TOKENS
+                if not list_batch or n_batch_tokens + n_piece_tokens > budget:
+                    list_batch.append([])
+                    n_batch_tokens = 0
+                list_batch[-1].append(
+                    encoding.decode(tokens[start : start + piece_size])
+                )
+                n_batch_tokens += n_piece_tokens
+        return list_batch
+
+    def _reduce_summaries(
+        self, texts: list[str], max_tokens: int, max_workers: int
+    ) -> list[str]:
+        """Reduce the summaries until they fit in one request
+        If the combined summaries do not fit in the context window next to the
+        prompt and max_tokens of output, they are reduced level by level:
+        each level summarizes batches that fit, concurrently, until the rest
+        fits in one request.
+        """
+        # intermediate batches get the longer of the two prompts
+        n_prompt_tokens = max(
+            count_tokens(
+                self._summaries_message("", is_final=is_final), self.model_name
+            )
+            for is_final in [True, False]
+        )
+        budget = (
+            self.context_window - n_prompt_tokens - max_tokens - REDUCE_MARGIN_TOKENS
+        )
+        if budget < 2 * max_tokens:
+            raise Exception("max_tokens is too large for the context window")
+
+        texts = list(texts)
+        while count_tokens("".join(texts), self.model_name) > budget:
+            list_batch = self._group_by_tokens(texts, budget)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                texts = list(
+                    executor.map(
+                        bind_span(
+                            lambda batch: self._complete(
+                                kind="reduced_summary",
+                                user_message=self._summaries_message(
+                                    "".join(batch), is_final=False
+                                ),
+                                max_tokens=max_tokens,
+                            )
+                            + " \n\n"
+                        ),
+                        list_batch,
+                    )
+                )
+        return texts
 
-        res = self.client.chat.completions.create(
-            model=self.model_name,
-            messages=[{"role": "user", "content": user_message}],
+    def summarize_summaries(
+        self, texts: list[str], max_tokens: int, max_workers: int = 8
+    ) -> str:
+        """Summarize the summaries"""
+        texts = self._reduce_summaries(texts, max_tokens, max_workers)
+        return self._complete(
+            kind="summary_of_summaries",
+            user_message=self._summaries_message("".join(texts), is_final=True),
             max_tokens=max_tokens,
         )
 
-        return res.choices[0].message.content
+    def stream_summarize_summaries(
+        self, texts: list[str], max_tokens: int, max_workers: int = 8
+    ) -> Iterator[str]:
+        """Summarize the summaries, yielding the final summary as it is generated
+        Intermediate levels of the reduction are not streamed.
+        """
+        texts = self._reduce_summaries(texts, max_tokens, max_workers)
+        yield from self._complete_stream(
+            kind="summary_of_summaries",
+            user_message=self._summaries_message("".join(texts), is_final=True),
+            max_tokens=max_tokens,
+        )
@@ -0,0 +1,175 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def hash_text(text: str) -> str:
+    """Returns the sha256 hex digest of the text"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def hash_file(file_path: Path) -> str:
+    """Returns the sha256 hex digest of the content of the file"""
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class ArtifactStore:
+    """Content-addressed store for audio chunks, transcripts, summaries and translations
+    Each artifact is a directory under root named by its key. Entries are
+    written to a temporary directory and renamed into place, so readers in
+    other sessions or processes never see a partial entry. Reading an entry
+    marks it as recently used, and the least recently used entries are
+    evicted when the total size exceeds max_bytes. The total is kept in
+    memory and entries are only walked when it exceeds max_bytes, which
+    also catches up with entries written by other processes.
+    """
+
+    TEXT_FILE_NAME = "data.txt"
+    SIZE_FILE_NAME = ".size"
+    # eviction frees space down to this share of max_bytes, so that a full
+    # store is walked once per many writes rather than on every write
+    EVICT_TARGET_RATIO = 0.9
+
+    def __init__(self, root: Path, max_bytes: int = 10 * 1024**3) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self.objects_dir = root / "objects"
+        self.tmp_dir = root / "tmp"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self._total_size: int | None = None
+
+    @staticmethod
+    def make_key(*parts: str | int) -> str:
+        """Make a key from content hashes, model names, prompt versions, etc."""
+        h = hashlib.sha256()
+        for part in parts:
+            h.update(str(part).encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        """Returns the directory of the entry for the key"""
+        return self.objects_dir / key[:2] / key
+
+    def get_path(self, key: str) -> Path | None:
+        """Returns the directory of the entry if it exists and marks it as used"""
+        entry_path = self._entry_path(key)
+        try:
+            os.utime(entry_path)
+        except FileNotFoundError:
+            return None
+        return entry_path
+
+    def get_text(self, key: str) -> str | None:
+        """Returns the text stored for the key if it exists"""
+        entry_path = self.get_path(key)
+        if entry_path is None:
+            return None
+        try:
+            with open(entry_path / self.TEXT_FILE_NAME, "r") as f:
+                return f.read()
+        except FileNotFoundError:
+            # evicted by another process after get_path
+            return None
+
+    def put_text(self, key: str, text: str) -> None:
+        """Store the text for the key"""
+        tmp_entry_path = Path(tempfile.mkdtemp(dir=self.tmp_dir))
+        with open(tmp_entry_path / self.TEXT_FILE_NAME, "w") as f:
+            f.write(text)
+        self._commit(key, tmp_entry_path)
+
+    def put_dir(self, key: str, src_dir: Path) -> Path:
+        """Store the files of src_dir for the key and return the entry directory
+        Files are hard-linked when possible, so src_dir stays usable until
+        the caller removes it.
+        """
+        tmp_entry_path = Path(tempfile.mkdtemp(dir=self.tmp_dir))
+        for file_path in src_dir.iterdir():
+            try:
+                os.link(file_path, tmp_entry_path / file_path.name)
+            except OSError:
+                shutil.copy2(file_path, tmp_entry_path / file_path.name)
+        return self._commit(key, tmp_entry_path)
+
+    def _commit(self, key: str, tmp_entry_path: Path) -> Path:
+        """Rename a fully written temporary entry into place and evict old entries"""
+        size = sum(p.stat().st_size for p in tmp_entry_path.iterdir())
+        with open(tmp_entry_path / self.SIZE_FILE_NAME, "w") as f:
+            f.write(str(size))
+        entry_path = self._entry_path(key)
+        entry_path.parent.mkdir(exist_ok=True)
+        try:
+            os.rename(tmp_entry_path, entry_path)
+        except OSError:
+            # another writer stored the same key first
+            shutil.rmtree(tmp_entry_path, ignore_errors=True)
+            return entry_path
+        with self.lock:
+            if self._total_size is None:
+                self._total_size = self._walk_total_size()
+            else:
+                self._total_size += size
+            is_over = self._total_size > self.max_bytes
+        if is_over:
+            self.evict(keep=entry_path)
+        return entry_path
+
+    def _list_entry(self) -> list[tuple[float, Path, int]]:
+        """Returns (mtime, path, size) of every entry"""
+        list_entry = []
+        for entry_path in self.objects_dir.glob("*/*"):
+            try:
+                mtime = entry_path.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            list_entry.append((mtime, entry_path, self._entry_size(entry_path)))
+        return list_entry
+
+    def _walk_total_size(self) -> int:
+        """Returns the total size of the entries on disk"""
+        return sum(size for _, _, size in self._list_entry())
+
+    def _entry_size(self, entry_path: Path) -> int:
+        """Returns the size of the entry recorded when it was stored"""
+        try:
+            with open(entry_path / self.SIZE_FILE_NAME, "r") as f:
+                return int(f.read())
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def evict(self, keep: Path | None = None) -> None:
+        """Remove least recently used entries until the store fits in
+        EVICT_TARGET_RATIO of max_bytes. The entry at keep is never removed,
+        so a new entry larger than the budget stays usable until the next
+        eviction.
+        """
+        with self.lock:
+            list_entry = self._list_entry()
+            total_size = sum(size for _, _, size in list_entry)
+            for _, entry_path, size in sorted(list_entry, key=lambda x: x[0]):
+                if total_size <= self.max_bytes * self.EVICT_TARGET_RATIO:
+                    break
+                if entry_path == keep:
+                    continue
+                # rename first so the entry disappears atomically for readers
+                tmp_entry_path = Path(tempfile.mkdtemp(dir=self.tmp_dir)) / "evicted"
+                try:
+                    os.rename(entry_path, tmp_entry_path)
+                except FileNotFoundError:
+                    pass
+                else:
+                    total_size -= size
+                shutil.rmtree(tmp_entry_path.parent, ignore_errors=True)
+            self._total_size = total_size
@@ -1,33 +1,274 @@
 import os
 import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Callable
 
+import ffmpeg
 import requests
-from pydub import AudioSegment
+import requests.adapters
 
+from modules.boundary_finder import find_boundaries
+from modules.tracer import bind_span, current_span, traced
+
+BLOCK_SIZE = 1024 * 1024
+MAX_RETRIES = 5
+TIMEOUT = 30
+# file size limit of the OpenAI transcription API
+MAX_UPLOAD_BYTES = 25 * 1024 * 1024
+# share of a chunk's byte budget kept free for container overhead and VBR
+BYTE_MARGIN = 0.05
+
+
+@dataclass(frozen=True)
+class TranscodeProfile:
+    """Encoding of the chunks uploaded for transcription"""
+
+    codec: str
+    extension: str
+    bit_rate: int
+    sample_rate: int = 16000
+    channels: int = 1
+    vbr: str | None = None
+
+
+# speech transcription only needs mono 16 kHz audio
+SPEECH_MP3 = TranscodeProfile(codec="libmp3lame", extension="mp3", bit_rate=32000)
+# constrained VBR keeps Opus chunks close to the byte size they were cut for
+SPEECH_OPUS = TranscodeProfile(
+    codec="libopus", extension="ogg", bit_rate=24000, vbr="constrained"
+)
+
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+)
+_SESSION.mount(
+    "http://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+)
 
-def _download_audio(url: str, title: str, output_dir: Path) -> Path:
-    """Downloads the audio from the podcast"""
-    r = requests.get(url)
 
+def _get_total_size(r: requests.Response, offset: int) -> int | None:
+    """Returns the full size of the file from the response headers if known"""
+    content_range = r.headers.get("Content-Range")
+    if r.status_code in (206, 416) and content_range is not None:
+        total = content_range.rsplit("/", 1)[-1]
+        return int(total) if total.isdigit() else None
+    content_length = r.headers.get("Content-Length")
+    if content_length is None or "Content-Encoding" in r.headers:
+        return None
+    return int(content_length) + offset
+
+
+def _get_validator(r: requests.Response) -> str | None:
+    """Returns the validator of the response to send as If-Range, if any
+    Weak ETags cannot be used with ranges, so Last-Modified is used instead.
+    """
+    etag = r.headers.get("ETag")
+    if etag is not None and not etag.startswith("W/"):
+        return etag
+    return r.headers.get("Last-Modified")
+
+
+@traced("download")
+def _download_audio(url: str, title: str, output_dir: Path) -> Path:
+    """Downloads the audio from the podcast
+    The body is streamed to disk in BLOCK_SIZE blocks over a pooled session.
+    If the connection drops, the download resumes from the partial file
+    with a Range request and the final size is checked against Content-Length.
+    The ETag or Last-Modified of the file is kept next to the partial file
+    and sent as If-Range, so a file changed on the server is downloaded
+    again rather than appended to the old bytes.
+    """
     output_path = output_dir / f"{title}.mp3"
-    with open(output_path, "wb") as f:
-        f.write(r.content)
+    partial_path = output_dir / f"{title}.mp3.part"
+    validator_path = output_dir / f"{title}.mp3.part.validator"
+    validator = validator_path.read_text() if validator_path.exists() else None
+    is_own_partial = False
+    total_size = None
+    download_span = current_span()
+    download_span.set(url=url)
+
+    for attempt in range(MAX_RETRIES + 1):
+        offset = partial_path.stat().st_size if partial_path.exists() else 0
+        if offset > 0 and validator is None and not is_own_partial:
+            # a partial file of an earlier run that cannot be checked
+            # against the file on the server
+            partial_path.unlink()
+            offset = 0
+        headers = {}
+        if offset > 0:
+            headers["Range"] = f"bytes={offset}-"
+            if validator is not None:
+                headers["If-Range"] = validator
+        try:
+            with _SESSION.get(url, headers=headers, stream=True, timeout=TIMEOUT) as r:
+                if r.status_code == 416:
+                    if _get_total_size(r, offset) == offset:
+                        # the partial file already holds the whole body
+                        total_size = offset
+                        break
+                    # the partial file is longer than the file, so start over
+                    partial_path.unlink(missing_ok=True)
+                    continue
+                r.raise_for_status()
+                if r.status_code != 206:
+                    # the server ignored the Range header or the file changed,
+                    # so start over
+                    offset = 0
+                    validator = _get_validator(r)
+                    if validator is None:
+                        validator_path.unlink(missing_ok=True)
+                    else:
+                        validator_path.write_text(validator)
+                is_own_partial = True
+                total_size = _get_total_size(r, offset)
+                with open(partial_path, "ab" if offset > 0 else "wb") as f:
+                    for block in r.iter_content(chunk_size=BLOCK_SIZE):
+                        f.write(block)
+                        download_span.add(bytes=len(block))
+        except (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+        ) as e:
+            if attempt == MAX_RETRIES:
+                raise e
+            continue
+
+        if total_size is None or partial_path.stat().st_size >= total_size:
+            break
+    else:
+        raise Exception(f"Failed to download {url} after {MAX_RETRIES} retries")
+
+    size = partial_path.stat().st_size
+    if total_size is not None and size != total_size:
+        raise Exception(
+            f"Downloaded size {size} does not match Content-Length {total_size}"
+        )
+    os.replace(partial_path, output_path)
+    validator_path.unlink(missing_ok=True)
 
     return output_path
 
 
-def _chunk_audio(file_path_to_chunk: Path, chunk_size: int) -> Path:
-    """Chunks the audio file into chunks (default 10 minutes)"""
+def _probe_audio(file_path: Path) -> tuple[int, int]:
+    """Returns the duration (milliseconds) and bit rate (bits/s) of the audio file"""
+    probe = ffmpeg.probe(str(file_path))
+    return (
+        int(float(probe["format"]["duration"]) * 1000),
+        int(probe["format"]["bit_rate"]),
+    )
+
+
+def _chunk_size_for_bytes(
+    target_chunk_bytes: int, bit_rate: int, silence_tolerance: int | None
+) -> int:
+    """Returns the chunk length (milliseconds) whose encoded size fits the target
+    Silence-aware cuts can lengthen a chunk by up to twice the tolerance,
+    so that is taken off as well.
+    """
+    chunk_size = int(target_chunk_bytes * (1 - BYTE_MARGIN) * 8 * 1000 / bit_rate)
+    if silence_tolerance is not None:
+        chunk_size -= 2 * silence_tolerance
+    return chunk_size
+
+
+@traced("export_chunk")
+def _export_chunk(
+    file_path: Path,
+    output_path: Path,
+    start: int,
+    end: int,
+    profile: TranscodeProfile | None = None,
+) -> Path:
+    """Writes the audio between start and end (milliseconds)
+    Without a profile the audio is copied without re-encoding.
+    """
+    if profile is None:
+        kwargs = {"acodec": "copy"}
+    else:
+        kwargs = {
+            "acodec": profile.codec,
+            "ac": profile.channels,
+            "ar": profile.sample_rate,
+            "audio_bitrate": profile.bit_rate,
+        }
+        if profile.vbr is not None:
+            kwargs["vbr"] = profile.vbr
+    (
+        ffmpeg.input(str(file_path), ss=start / 1000, t=(end - start) / 1000)
+        .audio.output(str(output_path), **kwargs)
+        .overwrite_output()
+        .run(quiet=True)
+    )
+    current_span().set(
+        audio_seconds=(end - start) / 1000, bytes=output_path.stat().st_size
+    )
+    return output_path
+
+
+@traced("chunk")
+def _chunk_audio(
+    file_path_to_chunk: Path,
+    chunk_size: int,
+    silence_tolerance: int | None = None,
+    profile: TranscodeProfile | None = None,
+    target_chunk_bytes: int | None = None,
+    max_workers: int = 4,
+    callback: Callable[[Path], None] | None = None,
+) -> Path:
+    """Chunks the audio file into chunks (default 10 minutes)
+    Each chunk is cut from the file by ffmpeg stream copy, so the episode is
+    never decoded to PCM, or transcoded with the profile if one is given.
+    If target_chunk_bytes is set, the chunk length is derived from it and
+    the output bit rate instead of chunk_size. If silence_tolerance
+    (milliseconds) is set, each cut is moved to the quietest point within
+    that distance of its target. Chunks are exported in parallel and callback
+    is called with the path of each chunk as soon as it is written.
+    """
     if file_path_to_chunk.exists() and file_path_to_chunk.suffix == ".mp3":
         title_audio = file_path_to_chunk.name.split(".")[0]
         output_chunk_dir = file_path_to_chunk.parent / title_audio
         os.makedirs(output_chunk_dir, exist_ok=True)
 
-        audio_segment = AudioSegment.from_mp3(file_path_to_chunk)
-        for i, chunk in enumerate(audio_segment[::chunk_size]):
-            idx = i if i >= 10 else f"0{i}"
-            chunk.export(f"{output_chunk_dir}/audio_{idx}.mp3", format="mp3")
+        duration, bit_rate = _probe_audio(file_path_to_chunk)
+        current_span().set(audio_seconds=duration / 1000)
+        if target_chunk_bytes is not None:
+            chunk_size = _chunk_size_for_bytes(
+                target_chunk_bytes,
+                bit_rate=bit_rate if profile is None else profile.bit_rate,
+                silence_tolerance=silence_tolerance,
+            )
+        extension = "mp3" if profile is None else profile.extension
+        if silence_tolerance is None:
+            list_start = list(range(0, duration, chunk_size))
+        else:
+            list_start = find_boundaries(
+                file_path_to_chunk,
+                duration=duration,
+                chunk_size=chunk_size,
+                tolerance=silence_tolerance,
+                max_workers=max_workers,
+            )
+        list_end = list_start[1:] + [duration]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(
+                    bind_span(_export_chunk),
+                    file_path=file_path_to_chunk,
+                    output_path=output_chunk_dir / f"audio_{i:02d}.{extension}",
+                    start=start,
+                    end=end,
+                    profile=profile,
+                )
+                for i, (start, end) in enumerate(zip(list_start, list_end))
+            ]
+            for future in as_completed(futures):
+                chunk_path = future.result()
+                if callback is not None:
+                    callback(chunk_path)
 
         # delete the original file
         os.remove(file_path_to_chunk)
@@ -35,17 +276,36 @@ def _chunk_audio(file_path_to_chunk: Path, chunk_size: int) -> Path:
         return output_chunk_dir
 
 
+@traced("download_and_chunk")
 def download_and_chunk_audio(
-    url: str, title: str, output_dir: Path, chunk_size: int = 10 * 60 * 1000
+    url: str,
+    title: str,
+    output_dir: Path,
+    chunk_size: int = 10 * 60 * 1000,
+    silence_tolerance: int | None = 30 * 1000,
+    profile: TranscodeProfile | None = None,
+    target_chunk_bytes: int | None = None,
+    max_workers: int = 4,
+    callback: Callable[[Path], None] | None = None,
 ) -> Path:
     """Downloads the audio from url and chunks it into chunks
     Input: url or list of url about the mp3 files
     Output: AudioPathDataCollection
     """
-    # remove the output directory if it exists to save space
-    if output_dir.exists():
-        shutil.rmtree(output_dir)
+    if target_chunk_bytes is not None and target_chunk_bytes > MAX_UPLOAD_BYTES:
+        raise Exception(f"Chunks cannot be larger than {MAX_UPLOAD_BYTES} bytes")
     output_dir.mkdir(parents=True, exist_ok=True)
+    # remove chunks left by an interrupted run of the same episode only
+    if (output_dir / title).exists():
+        shutil.rmtree(output_dir / title)
     file_path_to_chunk = _download_audio(url=url, title=title, output_dir=output_dir)
-    chunk_dir = _chunk_audio(file_path_to_chunk, chunk_size=chunk_size)
+    chunk_dir = _chunk_audio(
+        file_path_to_chunk,
+        chunk_size=chunk_size,
+        silence_tolerance=silence_tolerance,
+        profile=profile,
+        target_chunk_bytes=target_chunk_bytes,
+        max_workers=max_workers,
+        callback=callback,
+    )
     return chunk_dir
@@ -1,10 +1,13 @@
+import hashlib
 from dataclasses import dataclass
 from datetime import datetime
 from email.utils import parsedate_to_datetime
+from typing import Iterator
 
 import pandas as pd
 import requests
 from bs4 import BeautifulSoup, Tag
+from lxml import etree
 
 
 @dataclass(frozen=False)
@@ -17,12 +20,21 @@ class PodcastMetaData:
     duration: str | None
     description: str | None
     creator: str | None
+    guid: str | None = None
     id: str | None = None
 
     def __post_init__(self):
         if self.title is None or self.enclosure is None:
             raise Exception("Title and enclosure cannot be None")
 
+    @property
+    def stable_id(self) -> str:
+        """ID derived from the guid, or the enclosure url if there is no guid,
+        so that it does not change when new episodes are published
+        """
+        key = (self.guid or "").strip() or self.enclosure
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+
 
 @dataclass(frozen=False)
 class PodcastMetaDataCollection:
@@ -42,9 +54,9 @@ class PodcastMetaDataCollection:
         )
 
     def assign_ids(self):
-        """Assign a zero-padded ID based on the sorted position."""
-        for i, podcast_metadata in enumerate(self.list_podcast_metadata, start=1):
-            podcast_metadata.id = str(i).zfill(4)
+        """Assign a stable ID based on the guid or enclosure url."""
+        for podcast_metadata in self.list_podcast_metadata:
+            podcast_metadata.id = podcast_metadata.stable_id
 
     def to_dataframe(self) -> pd.DataFrame:
         """Create a dataframe from the list of PodcastMetaData"""
@@ -78,10 +90,15 @@ class PodcastMetaDataRetriever:
     """Retrieves the podcast audio from the given url
     Input: rss url
     Output: PodcastMetaDataCollection
+    backend "stream" parses the feed incrementally with lxml iterparse,
+    "soup" loads the whole feed into a BeautifulSoup tree
     """
 
-    def __init__(self, url: str) -> None:
+    def __init__(self, url: str, backend: str = "stream") -> None:
+        if backend not in ("stream", "soup"):
+            raise Exception(f"Unknown backend: {backend}")
         self.url = url
+        self.backend = backend
         self.list_tag = [
             "title",
             "enclosure",
@@ -89,6 +106,7 @@ class PodcastMetaDataRetriever:
             "duration",
             "description",
             "creator",
+            "guid",
         ]
 
     def _safe_find(self, item: Tag, tag: str) -> None | str:
@@ -108,23 +126,82 @@ class PodcastMetaDataRetriever:
         items = soup.find_all("item")
         return items
 
-    def get_data(self) -> PodcastMetaDataCollection:
-        """Returns a dataframe with the data from the podcast"""
-        items = self._get_items()
-        list_podcast_metadata = []
-
-        for item in items:
-            pubDate = self._safe_find(item, "pubDate")
-            pubDate = parsedate_to_datetime(pubDate) if pubDate is not None else None
-
-            podcastmetadata = PodcastMetaData(
-                title=self._safe_find(item, "title"),
-                enclosure=self._safe_find(item, "enclosure"),
-                pubDate=pubDate,
-                duration=self._safe_find(item, "duration"),
-                description=self._safe_find(item, "description"),
-                creator=self._safe_find(item, "creator"),
+    def _iter_soup(self) -> Iterator[PodcastMetaData]:
+        """Yields the metadata of each item of the feed parsed with BeautifulSoup"""
+        for item in self._get_items():
+            yield self._to_metadata(
+                {tag: self._safe_find(item, tag) for tag in self.list_tag}
             )
-            list_podcast_metadata.append(podcastmetadata)
 
-        return PodcastMetaDataCollection(list_podcast_metadata=list_podcast_metadata)
+    def _find_values(self, item: etree._Element) -> dict[str, str | None]:
+        """Returns the value of each tag in list_tag from the children of the item
+        Tags are matched by local name, so namespaced tags such as
+        itunes:duration and dc:creator are found as duration and creator.
+        An un-namespaced tag wins over a namespaced one of the same name.
+        """
+        values: dict[str, str | None] = dict.fromkeys(self.list_tag)
+        namespaced: set[str] = set()
+        for child in item:
+            if not isinstance(child.tag, str):
+                # comments and processing instructions
+                continue
+            qname = etree.QName(child)
+            tag = qname.localname
+            if tag not in values:
+                continue
+            if values[tag] is None or (tag in namespaced and qname.namespace is None):
+                if tag == "enclosure":
+                    values[tag] = child.get("url")
+                else:
+                    values[tag] = "".join(child.itertext())
+                if qname.namespace is None:
+                    namespaced.discard(tag)
+                else:
+                    namespaced.add(tag)
+        return values
+
+    def _iter_stream(self) -> Iterator[PodcastMetaData]:
+        """Yields the metadata of each item while the feed is being downloaded"""
+        with requests.get(self.url, stream=True) as r:
+            r.raise_for_status()
+            yield from self.iter_response(r)
+
+    def iter_response(self, r: requests.Response) -> Iterator[PodcastMetaData]:
+        """Yields the metadata of each item of a streamed feed response
+        Each item element is freed once its metadata is built, so memory
+        does not grow with the number of items.
+        """
+        r.raw.decode_content = True
+        for _, item in etree.iterparse(
+            r.raw, events=("end",), tag="{*}item", recover=True, huge_tree=True
+        ):
+            values = self._find_values(item)
+            item.clear()
+            while item.getprevious() is not None:
+                del item.getparent()[0]
+            yield self._to_metadata(values)
+
+    def _to_metadata(self, values: dict[str, str | None]) -> PodcastMetaData:
+        """Create PodcastMetaData from the values of the tags of an item"""
+        pubDate = values["pubDate"]
+        pubDate = parsedate_to_datetime(pubDate) if pubDate is not None else None
+
+        return PodcastMetaData(
+            title=values["title"],
+            enclosure=values["enclosure"],
+            pubDate=pubDate,
+            duration=values["duration"],
+            description=values["description"],
+            creator=values["creator"],
+            guid=values["guid"],
+        )
+
+    def iter_data(self) -> Iterator[PodcastMetaData]:
+        """Yields the metadata of each episode of the podcast one at a time"""
+        if self.backend == "stream":
+            return self._iter_stream()
+        return self._iter_soup()
+
+    def get_data(self) -> PodcastMetaDataCollection:
+        """Returns a dataframe with the data from the podcast"""
+        return PodcastMetaDataCollection(list_podcast_metadata=list(self.iter_data()))
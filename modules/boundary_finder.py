@@ -0,0 +1,78 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import ffmpeg
+import numpy as np
+
+from modules.tracer import bind_span, traced
+
+SAMPLE_RATE = 8000
+FRAME_MS = 20
+# pauses are found on energy smoothed over this many frames (200 ms)
+SMOOTHING_FRAMES = 10
+# decoding after a seek starts with a few silent frames, so this much audio
+# before the window is decoded and dropped
+PREROLL_MS = 500
+
+
+def _frame_rms(file_path: Path, start: int, duration: int) -> np.ndarray:
+    """Returns the RMS energy of each FRAME_MS frame between start and start + duration
+    Only that part of the file is decoded, to mono 16-bit PCM at SAMPLE_RATE.
+    """
+    preroll = min(start, PREROLL_MS)
+    out, _ = (
+        ffmpeg.input(
+            str(file_path), ss=(start - preroll) / 1000, t=(duration + preroll) / 1000
+        )
+        .audio.output("pipe:", format="s16le", ac=1, ar=SAMPLE_RATE)
+        .global_args("-loglevel", "error")
+        .run(capture_stdout=True, capture_stderr=True)
+    )
+    frame_length = SAMPLE_RATE * FRAME_MS // 1000
+    samples = np.frombuffer(out, dtype=np.int16)[SAMPLE_RATE * preroll // 1000 :]
+    n_frame = len(samples) // frame_length
+    frames = samples[: n_frame * frame_length].reshape(n_frame, frame_length)
+    return np.sqrt(np.mean(frames.astype(np.float32) ** 2, axis=1))
+
+
+def _find_quietest_point(file_path: Path, target: int, tolerance: int) -> int:
+    """Returns the quietest point (milliseconds) within tolerance of target"""
+    start = max(target - tolerance, 0)
+    rms = _frame_rms(file_path, start=start, duration=2 * tolerance)
+    if len(rms) == 0:
+        return target
+    n_smoothing = min(SMOOTHING_FRAMES, len(rms))
+    kernel = np.ones(n_smoothing) / n_smoothing
+    # only full averages, as padding would make the edges of the window look
+    # quiet; each one is centered n_smoothing // 2 frames after its index
+    smoothed = np.convolve(rms, kernel, mode="valid")
+    idx = int(np.argmin(smoothed)) + n_smoothing // 2
+    return start + idx * FRAME_MS + FRAME_MS // 2
+
+
+@traced("find_boundaries")
+def find_boundaries(
+    file_path: Path,
+    duration: int,
+    chunk_size: int,
+    tolerance: int,
+    max_workers: int = 4,
+) -> list[int]:
+    """Returns the start (milliseconds) of each chunk, cut at the quietest point
+    within tolerance of every multiple of chunk_size. Only the tolerance
+    windows are decoded, in parallel, so chunk lengths stay within
+    chunk_size +/- 2 * tolerance.
+    """
+    if 4 * tolerance > chunk_size:
+        raise Exception("Tolerance must be at most a quarter of the chunk size")
+    list_target = list(range(chunk_size, duration - tolerance, chunk_size))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list_boundary = list(
+            executor.map(
+                bind_span(
+                    lambda target: _find_quietest_point(file_path, target, tolerance)
+                ),
+                list_target,
+            )
+        )
+    return [0] + list_boundary
@@ -0,0 +1,65 @@
+import time
+from typing import Any, Iterator
+
+from openai import OpenAI
+
+from modules.tracer import TRACER, Span
+
+
+def add_usage(span: Span, usage: Any) -> None:
+    """Record the token usage of a chat completion on the span"""
+    if usage is not None:
+        span.add(
+            prompt_tokens=usage.prompt_tokens,
+            completion_tokens=usage.completion_tokens,
+        )
+
+
+class ChatStream:
+    """Content of a streamed chat completion, iterated as it is generated
+    finish_reason is set once the iteration is over. The request is timed
+    in a span named span_name, with the time to the first piece of content.
+    """
+
+    def __init__(
+        self,
+        client: OpenAI,
+        model_name: str,
+        user_message: str,
+        max_tokens: int,
+        span_name: str = "chat",
+    ) -> None:
+        self.finish_reason: str | None = None
+        self.span = TRACER.start_span(span_name, model=model_name)
+        try:
+            self.response = client.chat.completions.create(
+                model=model_name,
+                messages=[{"role": "user", "content": user_message}],
+                max_tokens=max_tokens,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+        except BaseException as e:
+            # nothing will be iterated, so the span ends here
+            self.span.set(error=repr(e))
+            TRACER.end_span(self.span)
+            raise
+
+    def __iter__(self) -> Iterator[str]:
+        try:
+            for chunk in self.response:
+                # the last chunk only carries the usage
+                add_usage(self.span, getattr(chunk, "usage", None))
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                if choice.delta.content:
+                    if "first_token_seconds" not in self.span.attributes:
+                        self.span.set(
+                            first_token_seconds=time.time() - self.span.start_time
+                        )
+                    yield choice.delta.content
+                if choice.finish_reason is not None:
+                    self.finish_reason = choice.finish_reason
+        finally:
+            TRACER.end_span(self.span)
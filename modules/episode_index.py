@@ -0,0 +1,181 @@
+import bisect
+import html
+import os
+import re
+import tempfile
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from modules.audio_metadata_retriever import PodcastMetaData, PodcastMetaDataCollection
+
+WORD_PATTERN = re.compile(r"\w+")
+TAG_PATTERN = re.compile(r"<[^>]*>")
+
+
+def tokenize(text: str | None) -> list[str]:
+    """Returns the lowercase words of a text, ignoring HTML tags and entities"""
+    if not text:
+        return []
+    return WORD_PATTERN.findall(html.unescape(TAG_PATTERN.sub(" ", text)).lower())
+
+
+def format_pub_date(pub_date: datetime | None) -> str | None:
+    """Returns the publication date as shown in episode lists"""
+    return pub_date.strftime("%Y/%m/%d") if pub_date is not None else None
+
+
+@dataclass(frozen=True)
+class EpisodePage:
+    """One page of the episodes matching a search
+    list_idx are rows of the index, newest episode first.
+    """
+
+    list_idx: list[int]
+    n_match: int
+    page: int
+    n_page: int
+
+
+class EpisodeIndex:
+    """Searchable list of the episodes of a feed, newest first
+    The fields shown in lists are kept in one list per field. Descriptions,
+    the largest field, are written to description_file_path and read back
+    one at a time. Title and description words are kept in an inverted
+    index from each word to the sorted rows that contain it. The file of
+    descriptions stays open until close, or until the index is collected.
+    """
+
+    def __init__(
+        self,
+        podcast_metadata_collection: PodcastMetaDataCollection,
+        description_file_path: Path,
+    ) -> None:
+        list_podcast_metadata = podcast_metadata_collection.list_podcast_metadata[::-1]
+        self.list_id = [item.id for item in list_podcast_metadata]
+        self.list_title = [item.title for item in list_podcast_metadata]
+        self.list_enclosure = [item.enclosure for item in list_podcast_metadata]
+        self.list_pub_date = [item.pubDate for item in list_podcast_metadata]
+        self.list_duration = [item.duration for item in list_podcast_metadata]
+        self.list_creator = [item.creator for item in list_podcast_metadata]
+        self.dict_row = {id_: idx for idx, id_ in enumerate(self.list_id)}
+
+        dict_posting: dict[str, list[int]] = {}
+        for idx, item in enumerate(list_podcast_metadata):
+            for term in set(tokenize(item.title)) | set(tokenize(item.description)):
+                dict_posting.setdefault(term, []).append(idx)
+        self.dict_posting = {
+            term: np.array(list_idx, dtype=np.int32)
+            for term, list_idx in dict_posting.items()
+        }
+        self.list_term = sorted(self.dict_posting)
+
+        self._write_descriptions(list_podcast_metadata, description_file_path)
+
+    def _write_descriptions(
+        self, list_podcast_metadata: list[PodcastMetaData], file_path: Path
+    ) -> None:
+        """Write the descriptions to the file and keep their offsets
+        The file is replaced atomically and kept open, so an index built
+        earlier from the same path still reads its own descriptions.
+        """
+        self.array_offset = np.zeros(len(list_podcast_metadata) + 1, dtype=np.int64)
+        fd, tmp_path = tempfile.mkstemp(dir=file_path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            for idx, item in enumerate(list_podcast_metadata):
+                data = (item.description or "").encode("utf-8")
+                f.write(data)
+                self.array_offset[idx + 1] = self.array_offset[idx] + len(data)
+        os.replace(tmp_path, file_path)
+        self._description_file = open(file_path, "rb")
+
+    def close(self) -> None:
+        """Close the file of descriptions"""
+        self._description_file.close()
+
+    def __del__(self) -> None:
+        # the index is dropped from caches while runs may still read it, so
+        # the file is closed once nothing refers to the index
+        if hasattr(self, "_description_file"):
+            self.close()
+
+    def __len__(self) -> int:
+        return len(self.list_id)
+
+    def get_row(self, episode_id: str) -> int | None:
+        """Returns the row of the episode id, or None if it is not in the feed"""
+        return self.dict_row.get(episode_id)
+
+    def get_label(self, idx: int) -> str:
+        """Returns the label of the episode of the row, for selection lists"""
+        pub_date_str = format_pub_date(self.list_pub_date[idx])
+        return f"No. {len(self) - idx}: {self.list_title[idx]} - {pub_date_str}"
+
+    def get_description(self, idx: int) -> str | None:
+        """Read the description of the episode of the row"""
+        start, end = self.array_offset[idx], self.array_offset[idx + 1]
+        if start == end:
+            return None
+        data = os.pread(self._description_file.fileno(), int(end - start), int(start))
+        return data.decode("utf-8")
+
+    def get_episode(self, idx: int) -> PodcastMetaData:
+        """Returns the metadata of the episode of the row"""
+        return PodcastMetaData(
+            title=self.list_title[idx],
+            enclosure=self.list_enclosure[idx],
+            pubDate=self.list_pub_date[idx],
+            duration=self.list_duration[idx],
+            description=self.get_description(idx),
+            creator=self.list_creator[idx],
+            id=self.list_id[idx],
+        )
+
+    def _find_prefix(self, prefix: str) -> np.ndarray:
+        """Returns the sorted rows containing a word that starts with prefix"""
+        start = bisect.bisect_left(self.list_term, prefix)
+        end = bisect.bisect_left(self.list_term, prefix + "\U0010ffff", lo=start)
+        if start == end:
+            return np.zeros(0, dtype=np.int32)
+        return np.unique(
+            np.concatenate(
+                [self.dict_posting[term] for term in self.list_term[start:end]]
+            )
+        )
+
+    def find(self, query: str) -> np.ndarray:
+        """Returns the sorted rows whose title or description contains every
+        word of the query. The last word also matches longer words, so that
+        results follow the query as it is typed.
+        """
+        list_word = tokenize(query)
+        if not list_word:
+            return np.arange(len(self), dtype=np.int32)
+        list_rows = [
+            self.dict_posting.get(word, np.zeros(0, dtype=np.int32))
+            for word in list_word[:-1]
+        ]
+        list_rows.append(self._find_prefix(list_word[-1]))
+        list_rows.sort(key=len)
+        rows = list_rows[0]
+        for other_rows in list_rows[1:]:
+            if len(rows) == 0:
+                break
+            rows = np.intersect1d(rows, other_rows, assume_unique=True)
+        return rows
+
+    def search(self, query: str, page: int = 0, page_size: int = 20) -> EpisodePage:
+        """Returns a page of the episodes matching the query, newest first
+        page is clamped to the last page.
+        """
+        rows = self.find(query)
+        n_page = max(1, -(-len(rows) // page_size))
+        page = min(max(page, 0), n_page - 1)
+        return EpisodePage(
+            list_idx=rows[page * page_size : (page + 1) * page_size].tolist(),
+            n_match=len(rows),
+            page=page,
+            n_page=n_page,
+        )
@@ -0,0 +1,99 @@
+import dataclasses
+import hashlib
+import json
+import os
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+import requests
+
+from modules.audio_metadata_retriever import (
+    PodcastMetaData,
+    PodcastMetaDataCollection,
+    PodcastMetaDataRetriever,
+)
+from modules.episode_index import EpisodeIndex
+
+TIMEOUT = 30
+
+
+class FeedStore:
+    """Persistent per-feed episode metadata refreshed with conditional requests
+    The ETag and Last-Modified of the last response are sent back to the
+    server, so an unchanged feed costs one 304 response and is not parsed.
+    When the feed has changed only items with an unseen stable id are added.
+    """
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, url: str) -> Path:
+        """Returns the file that holds the stored data of the feed"""
+        return self.root / f"{hashlib.sha256(url.encode('utf-8')).hexdigest()}.json"
+
+    def _load(self, url: str) -> dict:
+        """Returns the stored data of the feed, or empty data if there is none"""
+        try:
+            with open(self._path(url), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {"etag": None, "last_modified": None, "items": []}
+
+    def _save(self, url: str, data: dict) -> None:
+        """Atomically replace the stored data of the feed"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self._path(url))
+
+    @staticmethod
+    def _to_dict(podcast_metadata: PodcastMetaData) -> dict:
+        """Convert PodcastMetaData to a JSON serializable dict"""
+        item = dataclasses.asdict(podcast_metadata)
+        if podcast_metadata.pubDate is not None:
+            item["pubDate"] = podcast_metadata.pubDate.isoformat()
+        return item
+
+    @staticmethod
+    def _from_dict(item: dict) -> PodcastMetaData:
+        """Create PodcastMetaData from a dict made by _to_dict"""
+        item = dict(item)
+        if item["pubDate"] is not None:
+            item["pubDate"] = datetime.fromisoformat(item["pubDate"])
+        return PodcastMetaData(**item)
+
+    def refresh(self, url: str) -> PodcastMetaDataCollection:
+        """Revalidate the feed and return every episode seen so far"""
+        data = self._load(url)
+        headers = {}
+        if data["items"] and data["etag"] is not None:
+            headers["If-None-Match"] = data["etag"]
+        if data["items"] and data["last_modified"] is not None:
+            headers["If-Modified-Since"] = data["last_modified"]
+
+        with requests.get(url, headers=headers, stream=True, timeout=TIMEOUT) as r:
+            if r.status_code != 304:
+                r.raise_for_status()
+                known_ids = {item["id"] for item in data["items"]}
+                for podcast_metadata in PodcastMetaDataRetriever(url).iter_response(r):
+                    podcast_metadata.id = podcast_metadata.stable_id
+                    if podcast_metadata.id in known_ids:
+                        continue
+                    known_ids.add(podcast_metadata.id)
+                    data["items"].append(self._to_dict(podcast_metadata))
+                data["etag"] = r.headers.get("ETag")
+                data["last_modified"] = r.headers.get("Last-Modified")
+                self._save(url, data)
+
+        return PodcastMetaDataCollection(
+            list_podcast_metadata=[self._from_dict(item) for item in data["items"]]
+        )
+
+    def get_index(self, url: str) -> EpisodeIndex:
+        """Revalidate the feed and return a searchable index of its episodes"""
+        return EpisodeIndex(
+            self.refresh(url),
+            description_file_path=self._path(url).with_suffix(".descriptions"),
+        )
@@ -0,0 +1,131 @@
+import fcntl
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Iterator
+
+if TYPE_CHECKING:
+    from modules.pipeline import PipelineEvent, PipelineText
+
+# a job is queued for a worker thread, waiting for another process that
+# holds its lock, running, or finished as done or failed
+LIST_JOB_STATUS = ["queued", "waiting", "running", "done", "failed"]
+
+
+@contextmanager
+def file_lock(path: Path, on_wait: Callable[[], None] | None = None) -> Iterator[None]:
+    """Hold an exclusive lock on the file, shared with other processes
+    on_wait is called if another process holds the lock, before waiting for it.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a") as f:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            if on_wait is not None:
+                on_wait()
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class Job:
+    """State of a background job that any session can read
+    Progress events and streamed texts of the pipeline are kept as they
+    arrive, so a session that attaches late sees everything so far.
+    """
+
+    def __init__(self, key: str) -> None:
+        self.key = key
+        self.status = "queued"
+        self.dict_event: dict[str, "PipelineEvent"] = {}
+        self.dict_text: dict[tuple[str, int], str] = {}
+        self.result: Any = None
+        self.error: Exception | None = None
+        self.lock = threading.Lock()
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def on_event(self, event: "PipelineEvent") -> None:
+        """Keep the latest progress of the stage of the event"""
+        with self.lock:
+            self.dict_event[event.stage] = event
+
+    def on_text(self, pipeline_text: "PipelineText") -> None:
+        """Keep the latest text of the item of the stage"""
+        with self.lock:
+            self.dict_text[(pipeline_text.stage, pipeline_text.idx)] = (
+                pipeline_text.text
+            )
+
+    def snapshot(self) -> tuple[dict[str, "PipelineEvent"], dict[tuple[str, int], str]]:
+        """Returns copies of the progress events and texts so far"""
+        with self.lock:
+            return dict(self.dict_event), dict(self.dict_text)
+
+
+class JobManager:
+    """Runs jobs in background worker threads, at most one per key
+    Submitting a key whose job is queued or running returns that job, so
+    every session asking for the same episode attaches to one run. Jobs
+    also hold a file lock named after their key in lock_dir while they
+    run, so a job of another process with the same key runs first and
+    this one finds its artifacts in the store. Finished jobs are kept for
+    sessions that attach later, up to max_finished.
+    """
+
+    def __init__(self, lock_dir: Path, max_jobs: int = 2, max_finished: int = 64):
+        self.lock_dir = lock_dir
+        self.max_finished = max_finished
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_jobs, thread_name_prefix="job"
+        )
+        self.lock = threading.Lock()
+        self.dict_job: OrderedDict[str, Job] = OrderedDict()
+
+    def get(self, key: str) -> Job | None:
+        """Returns the latest job of the key, if any"""
+        with self.lock:
+            return self.dict_job.get(key)
+
+    def submit(self, key: str, run: Callable[[Job], Any]) -> Job:
+        """Start run(job) in a worker thread unless a job of the key is in flight
+        run reports progress through job.on_event and job.on_text, and its
+        return value becomes job.result.
+        """
+        with self.lock:
+            job = self.dict_job.get(key)
+            if job is not None and not job.is_finished:
+                return job
+            job = Job(key)
+            self.dict_job[key] = job
+            self.dict_job.move_to_end(key)
+            list_finished_key = [
+                finished_key
+                for finished_key, finished_job in self.dict_job.items()
+                if finished_job.is_finished
+            ]
+            for finished_key in list_finished_key[: -self.max_finished or None]:
+                del self.dict_job[finished_key]
+        # the job is a trace of its own, not part of the caller's span
+        self.executor.submit(self._run, job, run)
+        return job
+
+    def _run(self, job: Job, run: Callable[[Job], Any]) -> None:
+        def on_wait() -> None:
+            job.status = "waiting"
+
+        try:
+            with file_lock(self.lock_dir / f"{job.key}.lock", on_wait=on_wait):
+                job.status = "running"
+                job.result = run(job)
+            job.status = "done"
+        except Exception as e:
+            job.error = e
+            job.status = "failed"
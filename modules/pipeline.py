@@ -0,0 +1,456 @@
+import queue
+import shutil
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+from openai import OpenAI
+
+from modules.article_generator import ArticleGenerator
+from modules.artifact_store import ArtifactStore, hash_file
+from modules.audio_downloader import TranscodeProfile, download_and_chunk_audio
+from modules.text_splitter import TokenWindowSplitter
+from modules.tracer import bind_span, current_span, traced
+from modules.transcriber import OpenAIBackend, TranscriptionBackend
+
+# marks the end of the items put on a queue by a stage
+_DONE = object()
+# seconds between two reports of a text that is being generated
+STREAM_INTERVAL = 0.1
+
+
+class _Stopped(Exception):
+    """Raised in a stage when another stage of the pipeline has failed"""
+
+
+@dataclass(frozen=True)
+class PipelineEvent:
+    """Progress of one stage of the pipeline
+    n_total is None while the number of items of the stage is not known yet
+    """
+
+    stage: str
+    n_done: int
+    n_total: int | None = None
+
+
+@dataclass(frozen=True)
+class PipelineText:
+    """Text generated so far by one item of a stage"""
+
+    stage: str
+    idx: int
+    text: str
+
+
+@dataclass(frozen=True)
+class PipelineResult:
+    """Outputs of the pipeline for one episode"""
+
+    transcript: str
+    list_summary_detail: list[str]
+    summary: str
+
+
+class _RunState:
+    """State of one run of the pipeline, shared by its stages
+    Stages report events and failures to the caller's thread on events,
+    and stop once stop is set because another stage has failed.
+    """
+
+    def __init__(self, is_streamed: bool) -> None:
+        self.stop = threading.Event()
+        self.events: queue.Queue = queue.Queue()
+        self.is_streamed = is_streamed
+
+    def guard(self, target: Callable[..., None], *args: Any) -> None:
+        """Run a stage and report its failure to the caller's thread"""
+        try:
+            target(*args)
+        except _Stopped:
+            pass
+        except Exception as e:
+            self.stop.set()
+            self.events.put(e)
+
+    def put(self, q: queue.Queue, item: Any) -> None:
+        """Put an item on a bounded queue unless the pipeline has been stopped"""
+        while True:
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if self.stop.is_set():
+                    raise _Stopped()
+
+    def get(self, q: queue.Queue) -> Any:
+        """Get an item from a queue unless the pipeline has been stopped"""
+        while True:
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                if self.stop.is_set():
+                    raise _Stopped()
+
+    def stream_text(self, stage: str, idx: int, stream: Iterator[str]) -> str:
+        """Read a streamed text, reporting it at most every STREAM_INTERVAL seconds"""
+        text = ""
+        reported_at = 0.0
+        for piece in stream:
+            if self.stop.is_set():
+                raise _Stopped()
+            text += piece
+            if time.monotonic() - reported_at >= STREAM_INTERVAL:
+                self.events.put(PipelineText(stage=stage, idx=idx, text=text))
+                reported_at = time.monotonic()
+        self.events.put(PipelineText(stage=stage, idx=idx, text=text))
+        return text
+
+
+class EpisodePipeline:
+    """Download, chunk, transcribe and summarize an episode with overlapping stages
+    The stages run in background threads connected by bounded queues:
+    each chunk is transcribed as soon as it is written, and transcript text
+    is summarized as soon as a full token window of it has been transcribed.
+    Audio chunks, chunk transcripts, the episode transcript and summaries
+    are kept in the artifact store and reused by later runs.
+    Chunks are transcribed by transcription_backend, by default the OpenAI
+    API with transcribe_model_name. Each run keeps its own state, so one
+    pipeline can run several episodes at once.
+    """
+
+    def __init__(
+        self,
+        client: OpenAI,
+        store: ArtifactStore,
+        transcribe_model_name: str,
+        model_name: str,
+        chunk_size: int,
+        audio_chunk_size: int = 10 * 60 * 1000,
+        profile: TranscodeProfile | None = None,
+        target_chunk_bytes: int | None = None,
+        max_workers: int = 8,
+        queue_size: int = 4,
+        transcription_backend: TranscriptionBackend | None = None,
+    ) -> None:
+        self.client = client
+        self.store = store
+        self.transcribe_model_name = transcribe_model_name
+        self.transcription_backend = transcription_backend or OpenAIBackend(
+            client, transcribe_model_name
+        )
+        self.model_name = model_name
+        self.chunk_size = chunk_size
+        self.audio_chunk_size = audio_chunk_size
+        self.profile = profile
+        self.target_chunk_bytes = target_chunk_bytes
+        self.max_tokens = chunk_size * 2
+        self.max_workers = max_workers
+        self.queue_size = queue_size
+
+    @traced("episode")
+    def run(
+        self,
+        url: str,
+        title: str,
+        work_dir: Path,
+        callback: Callable[[PipelineEvent], None] | None = None,
+        text_callback: Callable[[PipelineText], None] | None = None,
+    ) -> PipelineResult:
+        """Run the pipeline for the episode and return its outputs
+        callback is called with a PipelineEvent in the caller's thread
+        each time a chunk, transcript or summary is finished.
+        If text_callback is set, summaries are streamed and it is called
+        with a PipelineText in the caller's thread as they are generated.
+        work_dir holds the download until its chunks are in the store.
+        """
+        current_span().set(title=title, url=url)
+        # kept per run, so that runs of one pipeline do not share it
+        state = _RunState(is_streamed=text_callback is not None)
+        chunk_queue: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        text_queue: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        audio_key = ArtifactStore.make_key(
+            "audio",
+            url,
+            self.audio_chunk_size,
+            self.profile,
+            self.target_chunk_bytes,
+        )
+        transcript_key = ArtifactStore.make_key(
+            "transcript", audio_key, self.transcription_backend.key
+        )
+        transcript = self.store.get_text(transcript_key)
+        article_generator = ArticleGenerator(
+            title=title,
+            client=self.client,
+            model_name=self.model_name,
+            chunk_size=self.chunk_size,
+            store=self.store,
+        )
+
+        threads = [
+            threading.Thread(
+                target=bind_span(state.guard),
+                args=(
+                    self._summarize,
+                    state,
+                    article_generator,
+                    transcript_key,
+                    transcript,
+                    text_queue,
+                ),
+                daemon=True,
+            )
+        ]
+        # a stored transcript means there is nothing to download or transcribe
+        if transcript is None:
+            threads.append(
+                threading.Thread(
+                    target=bind_span(state.guard),
+                    args=(
+                        self._produce_chunks,
+                        state,
+                        url,
+                        audio_key,
+                        work_dir,
+                        chunk_queue,
+                    ),
+                    daemon=True,
+                )
+            )
+            threads.extend(
+                threading.Thread(
+                    target=bind_span(state.guard),
+                    args=(self._transcribe, state, chunk_queue, text_queue),
+                    daemon=True,
+                )
+                for _ in range(self.max_workers)
+            )
+        for thread in threads:
+            thread.start()
+
+        while True:
+            event = state.events.get()
+            if isinstance(event, PipelineEvent):
+                if callback is not None:
+                    callback(event)
+            elif isinstance(event, PipelineText):
+                text_callback(event)
+            elif isinstance(event, PipelineResult):
+                # every chunk has been transcribed, so the download can go
+                shutil.rmtree(work_dir / audio_key, ignore_errors=True)
+                return event
+            else:
+                state.stop.set()
+                raise event
+
+    def _produce_chunks(
+        self,
+        state: _RunState,
+        url: str,
+        audio_key: str,
+        work_dir: Path,
+        chunk_queue: queue.Queue,
+    ) -> None:
+        """Put the audio chunks of the episode on the queue as they are written"""
+        chunk_dir = self.store.get_path(audio_key)
+        n_chunk = 0
+
+        def put_chunk(chunk_path: Path) -> None:
+            nonlocal n_chunk
+            n_chunk += 1
+            state.put(chunk_queue, chunk_path)
+            state.events.put(PipelineEvent(stage="chunk", n_done=n_chunk))
+
+        if chunk_dir is not None:
+            for chunk_path in sorted(chunk_dir.glob("audio_*")):
+                put_chunk(chunk_path)
+        else:
+            chunk_dir = download_and_chunk_audio(
+                url=url,
+                title=audio_key,
+                output_dir=work_dir,
+                chunk_size=self.audio_chunk_size,
+                profile=self.profile,
+                target_chunk_bytes=self.target_chunk_bytes,
+                callback=put_chunk,
+            )
+            self.store.put_dir(audio_key, chunk_dir)
+        state.events.put(PipelineEvent(stage="chunk", n_done=n_chunk, n_total=n_chunk))
+        # one end marker for each transcription worker
+        for _ in range(self.max_workers):
+            state.put(chunk_queue, (_DONE, n_chunk))
+
+    def _transcribe(
+        self, state: _RunState, chunk_queue: queue.Queue, text_queue: queue.Queue
+    ) -> None:
+        """Transcribe chunks from the queue and put (index, text) on the text queue"""
+        while True:
+            item = state.get(chunk_queue)
+            if isinstance(item, tuple) and item[0] is _DONE:
+                state.put(text_queue, item)
+                return
+            idx = int(item.stem.rsplit("_", 1)[-1])
+            key = ArtifactStore.make_key(
+                "chunk_transcript", hash_file(item), self.transcription_backend.key
+            )
+            text = self.store.get_text(key)
+            if text is None:
+                text = self.transcription_backend.transcribe(item)
+                self.store.put_text(key, text)
+            state.put(text_queue, (idx, text))
+
+    def _summarize(
+        self,
+        state: _RunState,
+        article_generator: ArticleGenerator,
+        transcript_key: str,
+        transcript: str | None,
+        text_queue: queue.Queue,
+    ) -> None:
+        """Reassemble the transcript in chunk order and summarize each token window
+        A stored transcript is summarized directly without reading the queue
+        """
+        list_future: list[Future] = []
+        n_summary_done = 0
+        n_summary_total = None
+        lock = threading.Lock()
+
+        def on_summary_done(future: Future) -> None:
+            nonlocal n_summary_done
+            with lock:
+                n_summary_done += 1
+                state.events.put(
+                    PipelineEvent(
+                        stage="summarize",
+                        n_done=n_summary_done,
+                        n_total=n_summary_total,
+                    )
+                )
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+
+            def submit(text: str) -> None:
+                if state.is_streamed:
+                    future = executor.submit(
+                        bind_span(state.stream_text),
+                        "summarize",
+                        len(list_future),
+                        article_generator.stream_summarize_transcript(
+                            title=article_generator.title,
+                            text=text,
+                            max_tokens=self.max_tokens,
+                        ),
+                    )
+                else:
+                    future = executor.submit(
+                        bind_span(article_generator.summarize_transcript),
+                        title=article_generator.title,
+                        text=text,
+                        max_tokens=self.max_tokens,
+                    )
+                future.add_done_callback(on_summary_done)
+                list_future.append(future)
+
+            text_splitter = article_generator.make_text_splitter()
+            if transcript is not None:
+                list_split_text = text_splitter.split_text(transcript)
+            else:
+                list_transcript = self._reassemble(
+                    state, text_splitter, text_queue, submit
+                )
+                transcript = "".join(list_transcript)
+                self.store.put_text(transcript_key, transcript)
+                list_split_text = text_splitter.flush()
+
+            for text in list_split_text:
+                submit(text)
+            with lock:
+                n_summary_total = len(list_future)
+                state.events.put(
+                    PipelineEvent(
+                        stage="summarize",
+                        n_done=n_summary_done,
+                        n_total=n_summary_total,
+                    )
+                )
+            list_summary_detail = []
+            for future in list_future:
+                if state.stop.is_set():
+                    raise _Stopped()
+                list_summary_detail.append(f"{future.result()} \n\n")
+
+        state.events.put(
+            PipelineEvent(stage="summarize_summaries", n_done=0, n_total=1)
+        )
+        if state.is_streamed:
+            summary = state.stream_text(
+                "summarize_summaries",
+                0,
+                article_generator.stream_summarize_summaries(
+                    texts=list_summary_detail,
+                    max_tokens=self.max_tokens,
+                    max_workers=self.max_workers,
+                ),
+            )
+        else:
+            summary = article_generator.summarize_summaries(
+                texts=list_summary_detail,
+                max_tokens=self.max_tokens,
+                max_workers=self.max_workers,
+            )
+        state.events.put(
+            PipelineEvent(stage="summarize_summaries", n_done=1, n_total=1)
+        )
+        state.events.put(
+            PipelineResult(
+                transcript=transcript,
+                list_summary_detail=list_summary_detail,
+                summary=summary,
+            )
+        )
+
+    def _reassemble(
+        self,
+        state: _RunState,
+        text_splitter: TokenWindowSplitter,
+        text_queue: queue.Queue,
+        submit: Callable[[str], None],
+    ) -> list[str]:
+        """Join chunk transcripts in order, submitting each full token window
+        Returns the transcripts of the chunks. The text of the last window
+        is left in text_splitter.
+        """
+        list_transcript: list[str] = []
+        pending: dict[int, str] = {}
+        n_worker_done = 0
+        n_chunk = None
+        while n_worker_done < self.max_workers:
+            item = state.get(text_queue)
+            if item[0] is _DONE:
+                n_worker_done += 1
+                n_chunk = item[1]
+                continue
+            idx, text = item
+            pending[idx] = text
+            state.events.put(
+                PipelineEvent(
+                    stage="transcribe",
+                    n_done=len(list_transcript) + len(pending),
+                    n_total=n_chunk,
+                )
+            )
+            while len(list_transcript) in pending:
+                text = pending.pop(len(list_transcript))
+                list_transcript.append(text)
+                for window in text_splitter.feed(text):
+                    submit(window)
+        state.events.put(
+            PipelineEvent(
+                stage="transcribe", n_done=len(list_transcript), n_total=n_chunk
+            )
+        )
+        return list_transcript
@@ -0,0 +1,316 @@
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Callable, Iterator, Mapping
+
+import ffmpeg
+import openai
+from openai import OpenAI
+
+from modules.tokenizer import count_tokens
+
+DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+DURATION_UNIT_SECONDS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def _parse_duration(value: str | None) -> float | None:
+    """Returns the seconds of a header such as '6m0s', '20ms' or '2'"""
+    if not value:
+        return None
+    list_match = DURATION_PATTERN.findall(value)
+    if not list_match:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(n) * DURATION_UNIT_SECONDS[unit] for n, unit in list_match)
+
+
+def _retry_after(headers: Mapping[str, str]) -> float | None:
+    """Returns the seconds to wait from the retry-after headers, if any"""
+    if headers.get("retry-after-ms"):
+        return float(headers["retry-after-ms"]) / 1000
+    return _parse_duration(headers.get("retry-after"))
+
+
+class _Budget:
+    """Token bucket holding up to per_minute units, refilled continuously"""
+
+    def __init__(self, per_minute: float | None) -> None:
+        self.per_minute = per_minute
+        self.level = per_minute
+        self.updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(
+            self.per_minute,
+            self.level + (now - self.updated_at) * self.per_minute / 60,
+        )
+        self.updated_at = now
+
+    def wait_for(self, amount: float) -> float:
+        """Returns the seconds until amount is available, 0 if it is now
+        A request larger than the bucket is let through when the bucket is full.
+        """
+        if self.per_minute is None:
+            return 0.0
+        self._refill()
+        needed = min(amount, self.per_minute)
+        if self.level >= needed:
+            return 0.0
+        return (needed - self.level) * 60 / self.per_minute
+
+    def take(self, amount: float) -> None:
+        if self.per_minute is not None:
+            self.level -= amount
+
+    def sync(self, limit: str | None, remaining: str | None) -> None:
+        """Correct the bucket with the rate limit headers of a response"""
+        if limit is not None and limit.isdigit():
+            if self.per_minute is None:
+                self.level = float(limit)
+                self.updated_at = time.monotonic()
+            self.per_minute = float(limit)
+        if self.per_minute is None or remaining is None or not remaining.isdigit():
+            return
+        # the server counts a request when it arrives, so requests still in
+        # flight are already taken from remaining
+        self.level = float(remaining)
+        self.updated_at = time.monotonic()
+
+
+class RequestScheduler:
+    """Admission control for the requests to one API endpoint
+    Before a request, its cost (tokens, or audio seconds) is taken from a
+    per-minute budget, and a concurrency slot is taken. Budgets follow the
+    x-ratelimit-* headers of responses. The number of slots grows by one per
+    window of successful requests and is halved on a 429 (AIMD). After a 429
+    no request starts until the retry-after time, and failed requests are
+    retried with exponential backoff and full jitter.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None,
+        initial_concurrency: int = 4,
+        max_concurrency: int = 32,
+        max_retries: int = 6,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+    ) -> None:
+        self.request_budget = _Budget(requests_per_minute)
+        self.token_budget = _Budget(tokens_per_minute)
+        self.concurrency = float(initial_concurrency)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.n_in_flight = 0
+        self.n_rate_limited = 0
+        self.condition = threading.Condition()
+        self._paused_until = 0.0
+        self._decreased_at = 0.0
+
+    def _acquire(self, cost: float) -> None:
+        """Wait for the budgets and a concurrency slot"""
+        with self.condition:
+            while True:
+                if self.n_in_flight >= int(self.concurrency):
+                    self.condition.wait()
+                    continue
+                wait = max(
+                    self._paused_until - time.monotonic(),
+                    self.request_budget.wait_for(1),
+                    self.token_budget.wait_for(cost),
+                )
+                if wait > 0:
+                    self.condition.wait(timeout=wait)
+                    continue
+                self.request_budget.take(1)
+                self.token_budget.take(cost)
+                self.n_in_flight += 1
+                return
+
+    def _release(self) -> None:
+        with self.condition:
+            self.n_in_flight -= 1
+            self.condition.notify_all()
+
+    def _on_headers(self, headers: Mapping[str, str]) -> None:
+        with self.condition:
+            self.request_budget.sync(
+                headers.get("x-ratelimit-limit-requests"),
+                headers.get("x-ratelimit-remaining-requests"),
+            )
+            self.token_budget.sync(
+                headers.get("x-ratelimit-limit-tokens"),
+                headers.get("x-ratelimit-remaining-tokens"),
+            )
+
+    def _on_success(self, headers: Mapping[str, str]) -> None:
+        self._on_headers(headers)
+        with self.condition:
+            # additive increase: about one more slot per window of successes
+            self.concurrency = min(
+                self.max_concurrency, self.concurrency + 1 / self.concurrency
+            )
+            self.condition.notify_all()
+
+    def _on_rate_limited(self, headers: Mapping[str, str]) -> float:
+        """Pause and shrink the concurrency, and return the seconds to wait"""
+        self._on_headers(headers)
+        retry_after = _retry_after(headers) or self.backoff_base
+        with self.condition:
+            self.n_rate_limited += 1
+            now = time.monotonic()
+            self._paused_until = max(self._paused_until, now + retry_after)
+            # multiplicative decrease, once for the requests that were in flight
+            if now - self._decreased_at > retry_after:
+                self.concurrency = max(1.0, self.concurrency / 2)
+                self._decreased_at = now
+        return retry_after
+
+    def _backoff(self, attempt: int) -> float:
+        """Returns a random wait below the exponential backoff of the attempt"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+    def call(self, create: Callable[..., Any], cost: float, **kwargs: Any) -> Any:
+        """Call a with_raw_response create method and return the parsed result
+        A stream keeps its concurrency slot until it has been read.
+        """
+        for attempt in range(self.max_retries + 1):
+            self._acquire(cost)
+            try:
+                raw_response = create(**kwargs)
+            except openai.APIStatusError as e:
+                self._release()
+                if e.status_code != 429 and e.status_code < 500:
+                    raise e
+                wait = 0.0
+                if e.status_code == 429:
+                    wait = self._on_rate_limited(e.response.headers)
+                if attempt == self.max_retries:
+                    raise e
+                time.sleep(max(wait, self._backoff(attempt)))
+                continue
+            except openai.APIConnectionError as e:
+                self._release()
+                if attempt == self.max_retries:
+                    raise e
+                time.sleep(self._backoff(attempt))
+                continue
+            except BaseException:
+                # any other failure, including interrupts, gives back its slot
+                self._release()
+                raise
+
+            try:
+                self._on_success(raw_response.headers)
+                result = raw_response.parse()
+            except BaseException:
+                self._release()
+                raise
+            if kwargs.get("stream"):
+                return _ReleasingStream(result, self._release)
+            self._release()
+            return result
+
+
+class _ReleasingStream:
+    """Stream that gives back its concurrency slot once it has been read,
+    closed or garbage collected
+    """
+
+    def __init__(self, stream: Any, release: Callable[[], None]) -> None:
+        self.stream = stream
+        self._release = release
+        self._lock = threading.Lock()
+        self._is_released = False
+
+    def __iter__(self) -> Iterator[Any]:
+        try:
+            yield from self.stream
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._is_released:
+                return
+            self._is_released = True
+        self.stream.close()
+        self._release()
+
+    def __del__(self) -> None:
+        self.close()
+
+
+def _chat_cost(kwargs: dict) -> float:
+    """Returns the tokens counted against the limit: the prompt and max_tokens"""
+    prompt = "".join(
+        message["content"]
+        for message in kwargs["messages"]
+        if isinstance(message.get("content"), str)
+    )
+    return count_tokens(prompt, kwargs["model"]) + (kwargs.get("max_tokens") or 0)
+
+
+def _transcription_cost(kwargs: dict) -> float:
+    """Returns the seconds of audio of the uploaded file"""
+    try:
+        return float(ffmpeg.probe(kwargs["file"].name)["format"]["duration"])
+    except Exception:
+        return 0.0
+
+
+class _ScheduledResource:
+    """Stands for client.chat.completions or client.audio.transcriptions"""
+
+    def __init__(
+        self,
+        resource: Any,
+        scheduler: RequestScheduler,
+        get_cost: Callable[[dict], float],
+    ) -> None:
+        self.resource = resource
+        self.scheduler = scheduler
+        self.get_cost = get_cost
+
+    def create(self, **kwargs: Any) -> Any:
+        return self.scheduler.call(
+            self.resource.with_raw_response.create, self.get_cost(kwargs), **kwargs
+        )
+
+
+class ScheduledClient:
+    """OpenAI client whose chat and transcription requests go through a
+    RequestScheduler each, so that threads sharing it stay under the
+    account's rate limits. The budget of transcriptions is in audio seconds.
+    """
+
+    def __init__(
+        self,
+        client: OpenAI,
+        chat_scheduler: RequestScheduler | None = None,
+        audio_scheduler: RequestScheduler | None = None,
+    ) -> None:
+        # retries are done by the schedulers
+        self.client = client.with_options(max_retries=0)
+        self.chat_scheduler = chat_scheduler or RequestScheduler()
+        self.audio_scheduler = audio_scheduler or RequestScheduler()
+        self.chat = SimpleNamespace(
+            completions=_ScheduledResource(
+                self.client.chat.completions, self.chat_scheduler, _chat_cost
+            )
+        )
+        self.audio = SimpleNamespace(
+            transcriptions=_ScheduledResource(
+                self.client.audio.transcriptions,
+                self.audio_scheduler,
+                _transcription_cost,
+            )
+        )
@@ -0,0 +1,135 @@
+import regex
+
+from modules.tokenizer import get_encoding
+from modules.tracer import traced
+
+# a window preferably ends after a token ending with one of these
+SENTENCE_END_CHARS = (".", "!", "?", "\n", "。", "！", "？")
+SENTENCE_ENDS = tuple(end.encode("utf-8") for end in SENTENCE_END_CHARS)
+
+
+def split_pages(text: str, page_chars: int) -> list[str]:
+    """Split text into pages of at most page_chars characters for display
+    A page preferably ends after the last sentence end in its second half.
+    """
+    list_page = []
+    start = 0
+    while len(text) - start > page_chars:
+        end = start + page_chars
+        cut = max(
+            text.rfind(char, start + page_chars // 2, end)
+            for char in SENTENCE_END_CHARS
+        )
+        end = cut + 1 if cut >= 0 else end
+        list_page.append(text[start:end])
+        start = end
+        while start < len(text) and text[start] == " ":
+            start += 1
+    if start < len(text) or not list_page:
+        list_page.append(text[start:])
+    return list_page
+
+
+class TokenWindowSplitter:
+    """Split text into windows of at most chunk_size tokens
+    The text is cut on token boundaries, preferably after the last sentence
+    end in the second half of the window, and the text after each window
+    is encoded again from where the next window starts. Text can also be
+    fed in pieces, and each window is returned as soon as the tokens it is
+    cut from can no longer change, so that fed windows are the same as
+    those of the whole text.
+    """
+
+    def __init__(self, model_name: str, chunk_size: int, chunk_overlap: int = 0):
+        if chunk_overlap * 2 >= chunk_size:
+            raise Exception("chunk_overlap must be less than half of chunk_size")
+        self.encoding = get_encoding(model_name)
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self._text = ""
+        self._dict_is_sentence_end: dict[int, bool] = {}
+        # the encoding splits text into pieces with this pattern before
+        # encoding each piece on its own
+        self._piece_pattern = regex.compile(self.encoding._pat_str)
+
+    def _is_sentence_end(self, token: int) -> bool:
+        """Returns whether the token ends a sentence"""
+        if token not in self._dict_is_sentence_end:
+            token_bytes = self.encoding.decode_single_token_bytes(token).rstrip(b" ")
+            self._dict_is_sentence_end[token] = token_bytes.endswith(SENTENCE_ENDS)
+        return self._dict_is_sentence_end[token]
+
+    def _is_char_start(self, token: int) -> bool:
+        """Returns whether the token does not start in the middle of a UTF-8 character"""
+        token_bytes = self.encoding.decode_single_token_bytes(token)
+        return not token_bytes or token_bytes[0] & 0xC0 != 0x80
+
+    def _find_cut(self, tokens: list[int]) -> int:
+        """Returns the number of tokens of the first window of tokens"""
+        if len(tokens) <= self.chunk_size:
+            return len(tokens)
+        for cut in range(self.chunk_size, self.chunk_size // 2, -1):
+            if self._is_sentence_end(tokens[cut - 1]):
+                return cut
+        # no sentence end, so cut anywhere that does not split a character
+        for cut in range(self.chunk_size, self.chunk_size // 2, -1):
+            if self._is_char_start(tokens[cut]):
+                return cut
+        return self.chunk_size
+
+    def _count_stable_tokens(self, text: str) -> int:
+        """Returns the number of leading tokens of the text that more text
+        cannot change. Text fed later can only change how the last two
+        pieces of the pattern of the encoding are matched.
+        """
+        list_start = [m.start() for m in self._piece_pattern.finditer(text)]
+        if len(list_start) < 2:
+            return 0
+        return len(self.encoding.encode(text[: list_start[-2]], disallowed_special=()))
+
+    def _split(self, text: str, is_final: bool) -> tuple[list[str], str]:
+        """Returns the complete windows of the text and the text not consumed
+        yet. A window is complete once more than chunk_size stable tokens
+        follow its start, or at the end of the text.
+        """
+        list_window = []
+        while text:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            if not is_final:
+                tokens = tokens[: self._count_stable_tokens(text)]
+                if len(tokens) <= self.chunk_size:
+                    break
+            cut = self._find_cut(tokens[: self.chunk_size + 1])
+            window = self.encoding.decode(tokens[:cut]).strip()
+            if window:
+                list_window.append(window)
+            if cut == len(tokens):
+                return list_window, ""
+            # the overlap starts at a token that does not split a character
+            start = cut - self.chunk_overlap
+            while start < cut and not self._is_char_start(tokens[start]):
+                start += 1
+            n_bytes = len(self.encoding.decode_bytes(tokens[:start]))
+            text = text.encode("utf-8")[n_bytes:].decode("utf-8", errors="replace")
+        return list_window, text
+
+    @traced("split")
+    def feed(self, text: str) -> list[str]:
+        """Add a piece of the text and return the windows completed by it
+        The text not consumed yet is encoded again with the piece, so that
+        the windows are the same as when the whole text is split at once.
+        """
+        list_window, self._text = self._split(self._text + text, is_final=False)
+        return list_window
+
+    def flush(self) -> list[str]:
+        """Return the remaining windows at the end of the text"""
+        list_window = self.split_text(self._text)
+        self._text = ""
+        return list_window
+
+    @traced("split")
+    def split_text(self, text: str) -> list[str]:
+        """Split the whole text into windows"""
+        list_window, _ = self._split(text, is_final=True)
+        return list_window
@@ -0,0 +1,20 @@
+from functools import lru_cache
+
+import tiktoken
+
+# encoding for models that tiktoken does not know yet
+DEFAULT_ENCODING_NAME = "o200k_base"
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model_name: str) -> tiktoken.Encoding:
+    """Returns the tiktoken encoding of the model, loaded once per process"""
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding(DEFAULT_ENCODING_NAME)
+
+
+def count_tokens(text: str, model_name: str) -> int:
+    """Returns the number of tokens of the text for the model"""
+    return len(get_encoding(model_name).encode(text, disallowed_special=()))
@@ -0,0 +1,310 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import warnings
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+import requests
+
+# numeric span attributes that are summed in the breakdown of a trace
+LIST_MEASURE = [
+    "bytes",
+    "audio_seconds",
+    "prompt_tokens",
+    "completion_tokens",
+]
+
+_current_span: contextvars.ContextVar["Span | None"] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+@dataclass
+class Span:
+    """Timed operation with attributes, nested in the span that was current
+    when it started. Spans with the same trace_id belong to one root span.
+    """
+
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: str | None
+    start_time: float
+    end_time: float | None = None
+    attributes: dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def duration(self) -> float:
+        """Wall time of the span in seconds, up to now if it has not ended"""
+        end_time = self.end_time if self.end_time is not None else time.time()
+        return end_time - self.start_time
+
+    def set(self, **attributes: Any) -> None:
+        """Set attributes of the span"""
+        self.attributes.update(attributes)
+
+    def add(self, **counts: float) -> None:
+        """Add to numeric attributes of the span"""
+        for key, count in counts.items():
+            self.attributes[key] = self.attributes.get(key, 0) + count
+
+    def to_dict(self) -> dict:
+        """Returns the span as a JSON serializable dict"""
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "duration": self.duration,
+            "attributes": self.attributes,
+        }
+
+
+class JsonLinesExporter:
+    """Append each finished trace to a file, one span per line"""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+
+    def export(self, list_span: list[Span]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        lines = "".join(
+            json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n"
+            for span in list_span
+        )
+        with self.lock, open(self.path, "a") as f:
+            f.write(lines)
+
+
+def _otlp_value(value: Any) -> dict:
+    """Returns the OTLP/JSON AnyValue of an attribute value"""
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OtlpExporter:
+    """Export each finished trace in the OpenTelemetry OTLP/JSON format
+    to a file (one export request per line, as read by the collector's
+    otlpjsonfile receiver) and/or to an OTLP/HTTP endpoint such as
+    http://localhost:4318
+    """
+
+    def __init__(
+        self,
+        path: Path | None = None,
+        endpoint: str | None = None,
+        service_name: str = "podcast-summary",
+    ) -> None:
+        self.path = path
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.lock = threading.Lock()
+
+    def _to_otlp(self, list_span: list[Span]) -> dict:
+        """Returns the export request of the spans"""
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            {
+                                "key": "service.name",
+                                "value": {"stringValue": self.service_name},
+                            }
+                        ]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": __name__},
+                            "spans": [
+                                {
+                                    "traceId": span.trace_id,
+                                    "spanId": span.span_id,
+                                    "parentSpanId": span.parent_id or "",
+                                    "name": span.name,
+                                    # SPAN_KIND_INTERNAL
+                                    "kind": 1,
+                                    "startTimeUnixNano": str(
+                                        int(span.start_time * 1e9)
+                                    ),
+                                    "endTimeUnixNano": str(int(span.end_time * 1e9)),
+                                    "attributes": [
+                                        {"key": key, "value": _otlp_value(value)}
+                                        for key, value in span.attributes.items()
+                                    ],
+                                }
+                                for span in list_span
+                            ],
+                        }
+                    ],
+                }
+            ]
+        }
+
+    def export(self, list_span: list[Span]) -> None:
+        request = self._to_otlp(list_span)
+        if self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.lock, open(self.path, "a") as f:
+                f.write(json.dumps(request, ensure_ascii=False) + "\n")
+        if self.endpoint is not None:
+            requests.post(
+                f"{self.endpoint.rstrip('/')}/v1/traces", json=request, timeout=10
+            ).raise_for_status()
+
+
+class Tracer:
+    """Collect spans and hand each trace to the exporters when its root span ends
+    The last max_traces traces are kept in memory for display.
+    """
+
+    def __init__(self, max_traces: int = 20) -> None:
+        self.max_traces = max_traces
+        self.list_exporter: list[JsonLinesExporter | OtlpExporter] = []
+        self.lock = threading.Lock()
+        self._dict_open: dict[str, list[Span]] = {}
+        self._dict_trace: OrderedDict[str, list[Span]] = OrderedDict()
+
+    def add_exporter(self, exporter: JsonLinesExporter | OtlpExporter) -> None:
+        with self.lock:
+            self.list_exporter.append(exporter)
+
+    def start_span(self, name: str, **attributes: Any) -> Span:
+        """Start a span in the current span without making it current
+        Use this for spans that stay open across a yield.
+        """
+        parent = _current_span.get()
+        span = Span(
+            name=name,
+            trace_id=parent.trace_id if parent is not None else os.urandom(16).hex(),
+            span_id=os.urandom(8).hex(),
+            parent_id=parent.span_id if parent is not None else None,
+            start_time=time.time(),
+            attributes=attributes,
+        )
+        with self.lock:
+            self._dict_open.setdefault(span.trace_id, []).append(span)
+        return span
+
+    def end_span(self, span: Span) -> None:
+        """End the span, and export its trace if it is a root span"""
+        span.end_time = time.time()
+        if span.parent_id is not None:
+            return
+        with self.lock:
+            list_span = self._dict_open.pop(span.trace_id, [])
+            self._dict_trace[span.trace_id] = list_span
+            while len(self._dict_trace) > self.max_traces:
+                self._dict_trace.popitem(last=False)
+            list_exporter = list(self.list_exporter)
+        # spans still open when their root ends are cut at its end
+        for child in list_span:
+            if child.end_time is None:
+                child.end_time = span.end_time
+        for exporter in list_exporter:
+            try:
+                exporter.export(list_span)
+            except Exception as e:
+                # a failing exporter must not fail the traced work
+                warnings.warn(f"Failed to export trace {span.trace_id}: {e!r}")
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Span]:
+        """Run the block in a new span nested in the current one"""
+        span = self.start_span(name, **attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.set(error=repr(e))
+            raise
+        finally:
+            _current_span.reset(token)
+            self.end_span(span)
+
+    def list_trace(self) -> list[list[Span]]:
+        """Returns the finished traces kept in memory, the latest first"""
+        with self.lock:
+            return [
+                list(list_span) for list_span in reversed(self._dict_trace.values())
+            ]
+
+
+TRACER = Tracer()
+
+
+def span(name: str, **attributes: Any):
+    """Run the block in a new span of the default tracer"""
+    return TRACER.span(name, **attributes)
+
+
+def current_span() -> Span | None:
+    """Returns the span of the running block, if any"""
+    return _current_span.get()
+
+
+def traced(name: str) -> Callable[[Callable], Callable]:
+    """Decorator running the function in a span of the default tracer
+    The function can add attributes to current_span().
+    """
+
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with TRACER.span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def bind_span(fn: Callable) -> Callable:
+    """Returns fn running in the span that is current now
+    Pass functions submitted to thread pools through this so that their
+    spans are nested in the caller's span.
+    """
+    parent = _current_span.get()
+
+    @functools.wraps(fn)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        token = _current_span.set(parent)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current_span.reset(token)
+
+    return wrapper
+
+
+def get_breakdown(list_span: list[Span]) -> list[dict]:
+    """Returns the number of calls, wall time and summed measures of each span name
+    Wall times of concurrent spans add up, so they can exceed the root's duration.
+    """
+    dict_row: dict[str, dict] = {}
+    for span in list_span:
+        row = dict_row.setdefault(
+            span.name,
+            {"name": span.name, "calls": 0, "seconds": 0.0}
+            | {measure: 0 for measure in LIST_MEASURE},
+        )
+        row["calls"] += 1
+        row["seconds"] += span.duration
+        for measure in LIST_MEASURE:
+            row[measure] += span.attributes.get(measure, 0)
+    return sorted(dict_row.values(), key=lambda row: row["seconds"], reverse=True)
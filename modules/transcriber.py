@@ -1,14 +1,199 @@
+import importlib.util
+import multiprocessing
+import os
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
+from typing import Any, Callable
 
 from openai import OpenAI
 
+from modules.tracer import bind_span, current_span, traced
+
+LIST_BACKEND = ["openai", "local", "stub"]
+
+# model of the local backend, loaded once in each worker process
+_local_model: Any = None
+
+
+class TranscriptionBackend(ABC):
+    """Turns audio files into text
+    key identifies the backend and its model in the keys of stored
+    transcripts. Subclasses implement _transcribe.
+    """
+
+    key: str
+
+    @abstractmethod
+    def _transcribe(self, audio_file_path: Path) -> str:
+        """Transcribes the audio file, without tracing"""
+
+    @traced("transcribe")
+    def transcribe(self, audio_file_path: Path) -> str:
+        """Transcribes the audio file"""
+        current_span().set(backend=self.key, bytes=audio_file_path.stat().st_size)
+        return self._transcribe(audio_file_path)
+
+    def transcribe_many(
+        self,
+        list_audio_file_path: list[Path],
+        max_workers: int = 8,
+        callback: Callable[[int, int], None] | None = None,
+    ) -> list[str]:
+        """Transcribes the audio files concurrently and returns transcripts in input order
+        callback is called with (number of finished chunks, number of chunks)
+        in the caller's thread each time a chunk finishes
+        """
+        list_transcript: list[str | None] = [None] * len(list_audio_file_path)
+        if not list_audio_file_path:
+            return []
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            future_to_idx = {
+                executor.submit(bind_span(self.transcribe), audio_file_path): idx
+                for idx, audio_file_path in enumerate(list_audio_file_path)
+            }
+            for n_done, future in enumerate(as_completed(future_to_idx), start=1):
+                list_transcript[future_to_idx[future]] = future.result()
+                if callback is not None:
+                    callback(n_done, len(list_audio_file_path))
+
+        return list_transcript
+
+    def close(self) -> None:
+        """Release the resources of the backend"""
+
+
+class OpenAIBackend(TranscriptionBackend):
+    """Transcribes with the OpenAI API"""
+
+    def __init__(self, client: OpenAI, model_name: str = "whisper-1") -> None:
+        self.client = client
+        self.model_name = model_name
+        # the key of the API backend is the bare model name, so that
+        # transcripts stored before backends existed are still found
+        self.key = model_name
+
+    def _transcribe(self, audio_file_path: Path) -> str:
+        with audio_file_path.open("rb") as audio_file:
+            transcript = self.client.audio.transcriptions.create(
+                model=self.model_name, file=audio_file
+            )
+        return transcript.text
+
+
+def _init_local_model(model_size: str, compute_type: str, cpu_threads: int) -> None:
+    """Load the model of the local backend in a worker process"""
+    from faster_whisper import WhisperModel
+
+    global _local_model
+    _local_model = WhisperModel(
+        model_size, device="cpu", compute_type=compute_type, cpu_threads=cpu_threads
+    )
+
+
+def _transcribe_local(audio_file_path: str, language: str | None) -> str:
+    """Transcribe with the model of the worker process"""
+    segments, _ = _local_model.transcribe(
+        audio_file_path, language=language, vad_filter=True
+    )
+    return "".join(segment.text for segment in segments)
+
+
+class LocalWhisperBackend(TranscriptionBackend):
+    """Transcribes on the CPU with faster-whisper, one chunk per worker process
+    Each process loads the model once, so a pool of n_workers processes
+    with cpu_threads threads each should fit the cores of the machine.
+    Needs the optional faster-whisper package.
+    """
+
+    def __init__(
+        self,
+        model_size: str = "small",
+        compute_type: str = "int8",
+        n_workers: int | None = None,
+        cpu_threads: int = 2,
+        language: str | None = None,
+    ) -> None:
+        if importlib.util.find_spec("faster_whisper") is None:
+            raise Exception(
+                "The local transcription backend needs faster-whisper: "
+                "pip install faster-whisper"
+            )
+        self.model_size = model_size
+        self.language = language
+        self.key = f"faster-whisper-{model_size}-{compute_type}"
+        if n_workers is None:
+            n_workers = max(1, (os.cpu_count() or 1) // cpu_threads)
+        # spawn, as forking a process that runs threads is unsafe
+        self.executor = ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_local_model,
+            initargs=(model_size, compute_type, cpu_threads),
+        )
+
+    def _transcribe(self, audio_file_path: Path) -> str:
+        return self.executor.submit(
+            _transcribe_local, str(audio_file_path), self.language
+        ).result()
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class StubBackend(TranscriptionBackend):
+    """Returns placeholder text as long as speech in the file would be,
+    without any model or network, for offline runs
+    """
+
+    key = "stub"
+
+    def __init__(self, bytes_per_second: int = 4000, words_per_second: float = 2.5):
+        self.bytes_per_second = bytes_per_second
+        self.words_per_second = words_per_second
+
+    def _transcribe(self, audio_file_path: Path) -> str:
+        audio_seconds = audio_file_path.stat().st_size / self.bytes_per_second
+        n_sentence = int(audio_seconds * self.words_per_second / 8) + 1
+        return "".join(
+            f"This is sentence {i} of {audio_file_path.stem}. "
+            for i in range(n_sentence)
+        )
+
+
+def get_backend(
+    name: str, client: OpenAI | None = None, model_name: str | None = None
+) -> TranscriptionBackend:
+    """Returns the backend of a name in LIST_BACKEND
+    model_name is the API model for "openai" and the model size for "local"
+    """
+    if name == "openai":
+        return OpenAIBackend(client, model_name=model_name or "whisper-1")
+    if name == "local":
+        return LocalWhisperBackend(model_size=model_name or "small")
+    if name == "stub":
+        return StubBackend()
+    raise Exception(f"Unknown transcription backend {name}, use one of {LIST_BACKEND}")
+
 
 def transcribe(
     client: OpenAI, audio_file_path: Path, model_name: str = "whisper-1"
 ) -> str:
     """Transcribes the audio file using the OpenAI API"""
-    with audio_file_path.open("rb") as audio_file:
-        transcript = client.audio.transcriptions.create(
-            model=model_name, file=audio_file
-        )
-    return transcript.text
+    return OpenAIBackend(client, model_name).transcribe(audio_file_path)
+
+
+def transcribe_many(
+    client: OpenAI,
+    list_audio_file_path: list[Path],
+    model_name: str = "whisper-1",
+    max_workers: int = 8,
+    callback: Callable[[int, int], None] | None = None,
+) -> list[str]:
+    """Transcribes the audio files concurrently with the OpenAI API
+    and returns transcripts in input order
+    """
+    return OpenAIBackend(client, model_name).transcribe_many(
+        list_audio_file_path, max_workers=max_workers, callback=callback
+    )
@@ -1,24 +1,303 @@
+import queue
+import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Iterator
+
 from openai import OpenAI
 
+from modules.artifact_store import ArtifactStore, hash_text
+from modules.chat_stream import ChatStream, add_usage
+from modules.tokenizer import count_tokens
+from modules.tracer import bind_span, span, traced
+
+# bump when the prompt changes so that stored translations are not reused
+PROMPT_VERSION = "1"
+SEGMENT_MARKER = "=== SEGMENT {} ==="
+SEGMENT_MARKER_PATTERN = re.compile(r"^=== SEGMENT (\d+) ===[ \t]*$", re.MULTILINE)
+
+
+def _translation_key(text: str, language: str, model_name: str) -> str:
+    """Returns the store key of the translation of the text"""
+    return ArtifactStore.make_key(
+        "translation", hash_text(text), language, model_name, PROMPT_VERSION
+    )
+
+
+def _translate_message(text: str, language: str) -> str:
+    """Returns the prompt to translate the text"""
+    user_message = f"""
+    You are a excellent translator to translate the text to {language}.
+
+    - Output should be {language} text.
+    - Output format should be markdown.
+
+    Text to translate: {text}
+    """
+    return user_message
+
 
 def translate(
-    text: str, language: str, client: OpenAI, model_name: str, max_tokens: int
+    text: str,
+    language: str,
+    client: OpenAI,
+    model_name: str,
+    max_tokens: int,
+    store: ArtifactStore | None = None,
 ) -> str:
     """Translate the article to the specified language"""
+    if store is not None:
+        key = _translation_key(text, language, model_name)
+        translated = store.get_text(key)
+        if translated is not None:
+            return translated
+
+    with span("translation", model=model_name) as chat_span:
+        res = client.chat.completions.create(
+            model=model_name,
+            messages=[{"role": "user", "content": _translate_message(text, language)}],
+            max_tokens=max_tokens,
+        )
+        add_usage(chat_span, res.usage)
+
+    translated = res.choices[0].message.content
+
+    if store is not None:
+        store.put_text(key, translated)
+    return translated
+
+
+def translate_stream(
+    text: str,
+    language: str,
+    client: OpenAI,
+    model_name: str,
+    max_tokens: int,
+    store: ArtifactStore | None = None,
+) -> Iterator[str]:
+    """Translate the article to the specified language, yielding the
+    translation as it is generated. A stored translation is yielded at once.
+    """
+    if store is not None:
+        key = _translation_key(text, language, model_name)
+        translated = store.get_text(key)
+        if translated is not None:
+            yield translated
+            return
 
+    list_piece = []
+    for piece in ChatStream(
+        client,
+        model_name,
+        _translate_message(text, language),
+        max_tokens,
+        span_name="translation",
+    ):
+        list_piece.append(piece)
+        yield piece
+
+    if store is not None:
+        store.put_text(key, "".join(list_piece))
+
+
+def _translate_one(
+    text: str,
+    language: str,
+    client: OpenAI,
+    model_name: str,
+    max_tokens: int,
+    on_text: Callable[[str], None] | None,
+) -> str:
+    """Translate a text, passing the translation so far to on_text if it is set"""
+    if on_text is None:
+        return translate(text, language, client, model_name, max_tokens)
+    translated = ""
+    for piece in translate_stream(text, language, client, model_name, max_tokens):
+        translated += piece
+        on_text(translated)
+    return translated
+
+
+def _translate_batch(
+    texts: list[str],
+    language: str,
+    client: OpenAI,
+    model_name: str,
+    max_tokens: int,
+    on_text: Callable[[int, str], None] | None = None,
+) -> list[str]:
+    """Translate several texts in one request
+    The texts are sent between numbered marker lines that the model must keep.
+    If the markers of the answer do not match, every text is translated
+    on its own instead. If on_text is set, the answer is streamed and
+    on_text is called with (index of the text, translation so far).
+    """
+
+    def translate_each() -> list[str]:
+        return [
+            _translate_one(
+                text,
+                language,
+                client,
+                model_name,
+                max_tokens,
+                on_text=(
+                    None
+                    if on_text is None
+                    else lambda translated, idx=idx: on_text(idx, translated)
+                ),
+            )
+            for idx, text in enumerate(texts)
+        ]
+
+    if len(texts) == 1:
+        return translate_each()
+
+    segments = "\n\n".join(
+        f"{SEGMENT_MARKER.format(i)}\n{text}" for i, text in enumerate(texts, start=1)
+    )
     user_message = f"""
     You are a excellent translator to translate the text to {language}.
 
     - Output should be {language} text.
     - Output format should be markdown.
+    - The text consists of {len(texts)} segments. Each segment starts with a marker line such as "{SEGMENT_MARKER.format(1)}".
+    - Translate each segment separately. Keep every marker line exactly as it is, in the same order, and do not add anything outside the segments.
 
-    Text to translate: {text}
+    Text to translate:
+
+{segments}
     """
 
-    res = client.chat.completions.create(
-        model=model_name,
-        messages=[{"role": "user", "content": user_message}],
-        max_tokens=max_tokens,
-    )
+    if on_text is None:
+        with span("translation_batch", model=model_name) as chat_span:
+            res = client.chat.completions.create(
+                model=model_name,
+                messages=[{"role": "user", "content": user_message}],
+                max_tokens=max_tokens,
+            )
+            add_usage(chat_span, res.usage)
+        content = res.choices[0].message.content
+        finish_reason = res.choices[0].finish_reason
+    else:
+        chat_stream = ChatStream(
+            client, model_name, user_message, max_tokens, span_name="translation_batch"
+        )
+        content = ""
+        for piece in chat_stream:
+            content += piece
+            parts = SEGMENT_MARKER_PATTERN.split(content)
+            # only the last segment grows, the previous ones are complete
+            if len(parts) > 1 and 1 <= int(parts[-2]) <= len(texts):
+                on_text(int(parts[-2]) - 1, parts[-1].strip())
+        finish_reason = chat_stream.finish_reason
+
+    parts = SEGMENT_MARKER_PATTERN.split(content)
+    # parts is [preamble, "1", segment 1, "2", segment 2, ...]
+    list_number = [int(number) for number in parts[1::2]]
+    if finish_reason == "length" or list_number != list(range(1, len(texts) + 1)):
+        return translate_each()
+    return [segment.strip() for segment in parts[2::2]]
+
+
+@traced("translate_many")
+def translate_many(
+    texts: list[str],
+    language: str,
+    client: OpenAI,
+    model_name: str,
+    max_tokens: int,
+    store: ArtifactStore | None = None,
+    max_input_tokens: int | None = None,
+    max_workers: int = 4,
+    callback: Callable[[int, int], None] | None = None,
+    stream_callback: Callable[[int, str], None] | None = None,
+) -> list[str]:
+    """Translate the texts with as few requests as possible, in input order
+    Texts that are not in the store are packed into requests of at most
+    max_input_tokens tokens (default: half of max_tokens, leaving room for
+    the translation to be longer than the source), and the requests run
+    concurrently. callback is called with (number of finished texts,
+    number of texts) in the caller's thread. If stream_callback is set,
+    the requests are streamed and it is called with (index of the text,
+    translation so far) in the caller's thread as the translations grow.
+    """
+    if max_input_tokens is None:
+        max_input_tokens = max_tokens // 2
+    list_translated: list[str | None] = [None] * len(texts)
+    list_todo: list[int] = []
+    for idx, text in enumerate(texts):
+        if store is not None:
+            list_translated[idx] = store.get_text(
+                _translation_key(text, language, model_name)
+            )
+        if list_translated[idx] is None:
+            list_todo.append(idx)
+
+    list_batch: list[list[int]] = []
+    n_batch_tokens = 0
+    for idx in list_todo:
+        n_tokens = count_tokens(texts[idx], model_name)
+        if not list_batch or n_batch_tokens + n_tokens > max_input_tokens:
+            list_batch.append([])
+            n_batch_tokens = 0
+        list_batch[-1].append(idx)
+        n_batch_tokens += n_tokens
+
+    n_done = len(texts) - len(list_todo)
+    if callback is not None:
+        callback(n_done, len(texts))
+    if stream_callback is not None:
+        for idx, translated in enumerate(list_translated):
+            if translated is not None:
+                stream_callback(idx, translated)
+    # partial translations from the workers, passed on in the caller's thread
+    text_queue: queue.Queue = queue.Queue()
+
+    def drain() -> None:
+        dict_translated = {}
+        while not text_queue.empty():
+            idx, translated = text_queue.get()
+            dict_translated[idx] = translated
+        for idx, translated in dict_translated.items():
+            stream_callback(idx, translated)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        future_to_batch = {
+            executor.submit(
+                bind_span(_translate_batch),
+                texts=[texts[idx] for idx in batch],
+                language=language,
+                client=client,
+                model_name=model_name,
+                max_tokens=max_tokens,
+                on_text=(
+                    None
+                    if stream_callback is None
+                    else lambda i, translated, batch=batch: text_queue.put(
+                        (batch[i], translated)
+                    )
+                ),
+            ): batch
+            for batch in list_batch
+        }
+        not_done = set(future_to_batch)
+        while not_done:
+            done, not_done = wait(not_done, timeout=0.1, return_when=FIRST_COMPLETED)
+            if stream_callback is not None:
+                drain()
+            for future in done:
+                batch = future_to_batch[future]
+                for idx, translated in zip(batch, future.result()):
+                    list_translated[idx] = translated
+                    if stream_callback is not None:
+                        stream_callback(idx, translated)
+                    if store is not None:
+                        store.put_text(
+                            _translation_key(texts[idx], language, model_name),
+                            translated,
+                        )
+                n_done += len(batch)
+                if callback is not None:
+                    callback(n_done, len(texts))
 
-    return res.choices[0].message.content
+    return list_translated